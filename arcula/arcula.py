@@ -3,14 +3,83 @@
 
 """Arcula: a secure, hierarchical deterministic wallet."""
 
+import collections
+import concurrent.futures
+import itertools
 import typing
 
 import ecdsa
 
-from . import hierarchy, crypto, encode, dhka
+from . import hierarchy, crypto, encode, dhka, cache, ec, certificates, compact, checkpoints
 
 __author__ = 'aldur'
 
+_PIPELINE_CHUNK_SIZE = 256  # The number of nodes that the PRF pass sends at once to a worker of the EC pass.
+_BATCH_SIZE = 1024  # The number of nodes whose public keys are computed at once, sharing a single modular inversion.
+
+
+class CertifiedNode(typing.NamedTuple):
+    """
+    The public material of a node, as output by `Arcula.iter_keygen`.
+    Nodes are numbered by their breadth-first `index`; `parent` is the index of the parent node (`None` for the root).
+    """
+    index: int
+    parent: typing.Optional[int]
+    id: int
+    public_key: bytes  # The 33 bytes compressed public signing key.
+    certificate: typing.Tuple[bytes, typing.Tuple[bytes, bytes]]
+    encrypted_edges: typing.List[typing.Tuple[bytes, bytes]]
+
+
+def _certify_worker(items: typing.Sequence[typing.Tuple[bytes, int]], certify: bool = True) \
+        -> typing.List[typing.Tuple[int, typing.Tuple[int, int], tuple]]:
+    """
+    Generate the signing keys and, if `certify`, the certificates of a chunk of nodes, given their private `_key` and
+    `id`.
+    Return the secret exponent and the public point of each signing key, together with its certificate.
+    """
+    wallet: Arcula = dhka._worker_scheme
+    keys, identifiers = zip(*items)
+    return wallet._certify_keys(wallet._cold_storage_key if certify else None, keys, identifiers)
+
+
+def _sign_worker(items: typing.Sequence[typing.Tuple[bytes, int]]) -> typing.List[tuple]:
+    """Certify a chunk of 33 bytes compressed public signing keys for their `id`."""
+    wallet: Arcula = dhka._worker_scheme
+    public_signing_keys, identifiers = zip(*items)
+    return wallet._create_certificates(wallet._cold_storage_key, public_signing_keys, identifiers)
+
+
+def _chunks(iterable: typing.Iterable, size: int) -> typing.Iterator[list]:
+    """Split `iterable` in lists of `size` items (the last one might be shorter)."""
+    iterator = iter(iterable)
+    return iter(lambda: list(itertools.islice(iterator, size)), [])
+
+
+class ColdStorageSigner:
+    """
+    Issue the deferred certificates of the nodes of a `wallet` after its keygen.
+
+    The cold storage key is sealed within the closure of the signer, that only exposes the issuance of certificates
+    for the signing keys of nodes; `close` forgets the key, after which no other certificate can be issued.
+    The EC backend of the wallet loads the key for each certificate, and does not retain it.
+    """
+
+    def __init__(self, wallet: 'Arcula', cold_storage_key: ecdsa.SigningKey):
+        def certify(public_signing_key: bytes, identifier: int) -> typing.Tuple[bytes, typing.Tuple[bytes, bytes]]:
+            return wallet._create_certificate(cold_storage_key, public_signing_key, identifier)
+
+        self._certify: typing.Optional[typing.Callable] = certify
+
+    def __call__(self, u: hierarchy.ArculaNode) -> typing.Tuple[bytes, typing.Tuple[bytes, bytes]]:
+        """Issue the certificate of the node `u`."""
+        assert self._certify is not None, 'The signer has been closed.'
+        return self._certify(encode.verification_key_to_bytes_33(u._signing_key.get_verifying_key()), u.id)
+
+    def close(self):
+        """Forget the cold storage key."""
+        self._certify = None  # Warning: This does not actually delete the keys from memory.
+
 
 class Arcula(dhka.DHKA):
     """
@@ -26,6 +95,16 @@ class Arcula(dhka.DHKA):
     2. A PRF function that outputs 256 bits.
     3/4. A symmetric encryption and decryption function.
     Please refer to their type hinting for their signatures.
+    `prf_batch_f` optionally evaluates `prf_f` under a single key for a sequence of messages.
+    `cache_size` bounds the number of nodes kept by the on-demand derivation of `derive_signing_key`, and the number
+    of signing keys of the nodes that are kept built (nodes only hold their secret scalars).
+    `ec_backend` computes the signing keys and the certificates; it defaults to the fastest backend supporting `curve`.
+    `certificate_cache` optionally stores the certificates across runs, so that they are only signed once.
+    `retention` selects the key material that the nodes retain after `keygen` (see `dhka.Retention`): signing-only
+    deployments can keep just the signing keys and the certificates.
+    `edge_encryption` selects when the edges are encrypted (see `dhka.EdgeEncryption`).
+    `checkpoints` optionally stores the secrets met by `derive_signing_key` at regular depths, so that the derivation
+    of deep nodes resumes from them (see `checkpoints.CheckpointStore`).
     """
 
     def __init__(
@@ -34,21 +113,35 @@ class Arcula(dhka.DHKA):
             prf_f: typing.Callable[[bytes, bytes], bytes] = crypto.sha3_512_half_k,
             enc_f: typing.Callable[[bytes, bytes], typing.Tuple[bytes, bytes]] = crypto.aes_ae,
             dec_f: typing.Callable[[bytes, typing.Tuple[bytes, bytes]], bytes] = crypto.aes_ad,
-            curve: ecdsa.curves.Curve = ecdsa.SECP256k1
+            curve: ecdsa.curves.Curve = ecdsa.SECP256k1,
+            cache_size: int = 1024,
+            prf_batch_f: typing.Optional[typing.Callable[[bytes, typing.Sequence[bytes]], typing.List[bytes]]] = None,
+            ec_backend: typing.Optional[ec.Backend] = None,
+            certificate_cache: typing.Optional[certificates.CertificateCache] = None,
+            retention: dhka.Retention = dhka.Retention.FULL,
+            edge_encryption: dhka.EdgeEncryption = dhka.EdgeEncryption.EAGER,
+            checkpoints: typing.Optional['checkpoints.CheckpointStore'] = None,
     ):
-        super().__init__(root, prf_f, enc_f, dec_f)
+        super().__init__(root, prf_f, enc_f, dec_f, cache_size, prf_batch_f, retention, edge_encryption, checkpoints)
         self.hash_f = hash_f  # A hash function that outputs 256 bits
         self.curve: ecdsa.curves.Curve = curve  # An ECDSA curve
+        self.ec_backend: ec.Backend = ec_backend or ec.default_backend(curve)
+        assert self.ec_backend.curve == curve
+        self.certificate_cache = certificate_cache
+        self.signer: typing.Optional[ColdStorageSigner] = None  # Issues the deferred certificates of a lazy keygen
+        self.signing_keys = ec.SigningKeys(curve, self.ec_backend, cache_size)  # Builds the signing keys of the nodes
 
         self.cold_storage_public_key: typing.Optional[ecdsa.VerifyingKey] = None  # The cold storage public key
 
+        self._signing_fingerprint: typing.Optional[bytes] = None  # The seed the signing cache refers to
+        self._signing_cache = cache.LRUCache(cache_size)  # Maps paths to their signing key and certificate
+
     def _cold_storage_keys(self, seed: bytes) -> ecdsa.SigningKey:
         """Generate the cold storage pair of signing keys starting from the initial `seed`."""
-        return crypto.ecdsa_keygen(seed, curve=self.curve)
+        return crypto.ecdsa_keygen(seed, curve=self.curve, backend=self.ec_backend)
 
-    @staticmethod
     def _create_certificate(
-            cold_storage_key: ecdsa.SigningKey, public_signing_key: ecdsa.VerifyingKey, identifier: int
+            self, cold_storage_key: ecdsa.SigningKey, public_signing_key: bytes, identifier: int
     ) -> typing.Tuple[bytes, typing.Tuple[bytes, bytes]]:
         """
         Create a certificate of the `cold_storage_key` that authorizes the `public_signing_key` to spend of behalf of
@@ -59,33 +152,302 @@ class Arcula(dhka.DHKA):
         The `certificate` is encoded through the canonical DER serialization format described in BIP66
         https://github.com/bitcoin/bips/blob/master/bip-0066.mediawiki.
 
-        The current implementation encodes the `identifier` as 8 big endian bytes and the `public_signing_key` to a
-        33 bytes compressed representation.
+        The current implementation encodes the `identifier` as 8 big endian bytes and takes the `public_signing_key` in
+        its 33 bytes compressed representation.
+        """
+        [certificate] = self._create_certificates(cold_storage_key, [public_signing_key], [identifier])
+        return certificate
+
+    def _create_certificates(
+            self, cold_storage_key: ecdsa.SigningKey,
+            public_signing_keys: typing.Sequence[bytes], identifiers: typing.Sequence[int]
+    ) -> typing.List[typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]:
         """
-        public_signing_key = encode.verification_key_to_bytes_33(public_signing_key)
-        identifier = encode.int_to_bytes_8(identifier)
-        return crypto.ecdsa_sign(cold_storage_key, public_signing_key + identifier), (public_signing_key, identifier)
+        Like `_create_certificate`, for many public signing keys: the missing certificates are signed in a single
+        batch, so that the backend loads the `cold_storage_key` once (and does not retain it).
+        """
+        assert all(len(public_signing_key) == 33 for public_signing_key in public_signing_keys)
+        messages = [(k, encode.int_to_bytes_8(identifier)) for k, identifier in zip(public_signing_keys, identifiers)]
+
+        signatures: typing.List[typing.Optional[bytes]] = [None] * len(messages)
+        keys = None
+        if self.certificate_cache is not None:
+            cold_storage_public_key = encode.verification_key_to_bytes_33(cold_storage_key.get_verifying_key())
+            keys = [certificates.certificate_key(cold_storage_public_key, *message) for message in messages]
+            signatures = [self.certificate_cache.get(key) for key in keys]
+
+        misses = [i for i, signature in enumerate(signatures) if signature is None]
+        signed = crypto.ecdsa_sign_batch(
+            cold_storage_key, [b''.join(messages[i]) for i in misses], self.ec_backend
+        ) if misses else []
+        for i, signature in zip(misses, signed):
+            signatures[i] = signature
+            if keys is not None:
+                self.certificate_cache[keys[i]] = signature
+        return list(zip(signatures, messages))
+
+    def _cold_storage_point(self) -> ec.Point:
+        assert self.cold_storage_public_key is not None, 'The wallet has not been set up yet.'
+        point = self.cold_storage_public_key.pubkey.point
+        return point.x(), point.y()
 
-    def keygen(self, seed: bytes):
-        """Generate a pair of signing keys and a certificate for each node of the hierarchy."""
+    def verify_certificate(self, certificate: typing.Tuple[bytes, typing.Tuple[bytes, bytes]]) -> bool:
+        """Return whether `certificate` has been issued by the cold storage key of the wallet."""
+        signature, (public_signing_key, identifier) = certificate
+        return self.ec_backend.verify(self._cold_storage_point(), signature, public_signing_key + identifier)
+
+    def audit(self) -> bool:
+        """Verify that each node of the hierarchy holds a certificate for its identifier."""
+        self.ec_backend.precompute(self._cold_storage_point())
+        return all(
+            u.certificate[1][1] == encode.int_to_bytes_8(u.id) and self.verify_certificate(u.certificate)
+            for u in hierarchy.breadth_first(self.root)
+        )
+
+    def keygen(self, seed: bytes, workers: int = 1, lazy: bool = False):
+        """
+        Generate a pair of signing keys and a certificate for each node of the hierarchy.
+
+        When `workers` is greater than one, keygen runs as a pipeline: the inexpensive PRF/AES pass of the DHKA runs
+        sequentially, and streams the derived nodes to `workers` processes that generate their signing keys and
+        certificates.
+
+        When `lazy`, the certificates are only issued on the first access to the `certificate` of each node.
+        Until then, the cold storage key is kept in memory by the `signer` of the wallet (see `ColdStorageSigner`).
+        """
         assert len(seed) == 512 // 8, len(seed)
-        super().keygen(seed[:256 // 8])
+        assert workers > 0
+        assert self.retention is not dhka.Retention.SIGNING or not isinstance(self.root, compact.Node), \
+            'Compact hierarchies derive the signing keys from the private keys, that should be retained.'
 
         # Setup the wallet key.
         cold_storage_key = self._cold_storage_keys(seed[256 // 8:])
         self.cold_storage_public_key = cold_storage_key.get_verifying_key()
 
-        q = [self.root, ]
+        if self.signer is not None:
+            self.signer.close()
+        self.signer = ColdStorageSigner(self, cold_storage_key) if lazy else None
+
+        self._derive_root(seed[:256 // 8])
+        nodes = itertools.chain([self.root], self._iter_keygen_subtree(self.root))
+
+        certifying_key = None if lazy else cold_storage_key
+        if workers > 1:
+            self._certify_pipeline(certifying_key, nodes, workers)
+        else:
+            for chunk in _chunks(nodes, _BATCH_SIZE):
+                self._certify_nodes(certifying_key, chunk)
+
+        del cold_storage_key  # Warning: This does not actually delete the keys from memory.
+
+    def iter_keygen(self, seed: bytes) -> typing.Iterator[CertifiedNode]:
+        """
+        Generate a pair of signing keys and a certificate for each node of the hierarchy, without assigning them to
+        the nodes.
+
+        Yield the public key, the certificate, and the encrypted edges of each node in breadth-first order.
+        The memory required is bounded by the width of the tree (and by the batches of the public key computation),
+        so that the output can be streamed elsewhere.
+        """
+        assert len(seed) == 512 // 8, len(seed)
+
+        cold_storage_key = self._cold_storage_keys(seed[256 // 8:])
+        self.cold_storage_public_key = cold_storage_key.get_verifying_key()
+
+        for chunk in _chunks(super().iter_keygen(seed[:256 // 8]), _BATCH_SIZE):
+            certified = self._certify_keys(cold_storage_key, [d.key for d in chunk], [d.id for d in chunk])
+            for derived, (_, _, certificate) in zip(chunk, certified):
+                yield CertifiedNode(
+                    derived.index, derived.parent, derived.id, certificate[1][0], certificate, derived.encrypted_edges
+                )
+
+        del cold_storage_key  # Warning: This does not actually delete the keys from memory.
+
+    def _certify_keys(
+            self, cold_storage_key: typing.Optional[ecdsa.SigningKey],
+            keys: typing.Sequence[bytes], identifiers: typing.Sequence[int]
+    ) -> typing.List[typing.Tuple[int, ec.Point, typing.Optional[typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]]]:
+        """
+        Generate the signing keys of many nodes from their private `keys`, and certify them for their `identifiers`.
+        Return the secret exponent and the public point of each signing key, together with its certificate (`None`
+        if no `cold_storage_key` is provided).
+
+        The public points are computed in a single batch, so that they share their modular inversion.
+        """
+        exponents = [crypto.ecdsa_exponent(key, self.curve) for key in keys]
+        points = self.ec_backend.public_points(exponents)
+        if cold_storage_key is None:
+            return [(exponent, point, None) for exponent, point in zip(exponents, points)]
+
+        issued = self._create_certificates(
+            cold_storage_key, [encode.point_to_bytes_33(point) for point in points], identifiers
+        )
+        return list(zip(exponents, points, issued))
+
+    def _set_signing_key(self, u: hierarchy.ArculaNode, exponent: int, certificate):
+        """
+        Assign the signing key and the `certificate` of `u` (to be issued by the `signer` if `None`).
+        Only the secret `exponent` is stored: the signing key is built on demand by `signing_keys`.
+        """
+        u._signing_scalar, u._signing_keys = encode.int_to_bytes_32(exponent), self.signing_keys
+        u.certificate = certificate
+        if certificate is None:
+            u._certificate_issuer = self.signer
+        if self.retention is dhka.Retention.SIGNING:
+            u._key = None
+
+    def _certify_nodes(
+            self, cold_storage_key: typing.Optional[ecdsa.SigningKey], nodes: typing.Sequence[hierarchy.ArculaNode]
+    ):
+        """
+        Generate a pair of signing keys and a certificate for each of the already derived `nodes`.
+        Without a `cold_storage_key`, the certificates are deferred to the `signer`.
+        """
+        certified = self._certify_keys(cold_storage_key, [u._key for u in nodes], [u.id for u in nodes])
+        for u, (exponent, _, certificate) in zip(nodes, certified):
+            self._set_signing_key(u, exponent, certificate)
+
+    def _certify_subtrees(
+            self, cold_storage_key: typing.Optional[ecdsa.SigningKey], roots: typing.Iterable[hierarchy.ArculaNode]
+    ):
+        """
+        Generate a pair of signing keys and a certificate for each node of the subtrees starting at `roots`.
+        Without a `cold_storage_key`, the certificates are deferred to the `signer`.
+        """
+        q = collections.deque(roots)
         visited = set()
+        nodes = []
         while q:
-            u = q.pop(0)
+            u = q.popleft()
             visited.add(u)
-            u._signing_key = crypto.ecdsa_keygen(u._key, self.curve)
-            u.certificate = self._create_certificate(cold_storage_key, u._signing_key.get_verifying_key(), u.id)
+            nodes.append(u)
 
-            assert len(set(e.id for e in u.edges)) == len(u.edges)
             for v in u.edges:
                 if v not in visited:
                     q.append(v)
 
+        for chunk in _chunks(nodes, _BATCH_SIZE):
+            self._certify_nodes(cold_storage_key, chunk)
+
+    def _certify_pipeline(
+            self, cold_storage_key: typing.Optional[ecdsa.SigningKey], nodes: typing.Iterable[hierarchy.ArculaNode],
+            workers: int
+    ):
+        """
+        Generate a pair of signing keys and a certificate for each of the already derived `nodes` in `workers`
+        processes, while the `nodes` are still being derived.
+
+        With a certificate cache, the workers first compute the public keys, that are looked up in the cache here; only
+        the missing certificates are then signed by the workers, and added to the cache.
+        """
+        scheme = self._worker_copy()
+        scheme._cold_storage_key = cold_storage_key
+
+        cold_storage_public_key = None
+        if cold_storage_key is not None and self.certificate_cache is not None:
+            cold_storage_public_key = encode.verification_key_to_bytes_33(self.cold_storage_public_key)
+
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=dhka._init_keygen_worker, initargs=(scheme, )
+        ) as executor:
+            certify = cold_storage_public_key is None  # Otherwise, certify only the nodes that miss from the cache.
+            chunks = [
+                (chunk, executor.submit(_certify_worker, [(u._key, u.id) for u in chunk], certify))
+                for chunk in _chunks(nodes, _PIPELINE_CHUNK_SIZE)
+            ]
+
+            signed = []
+            for chunk, future in chunks:
+                certified, misses = future.result(), []
+                if cold_storage_public_key is not None:
+                    for i, (u, (exponent, point, _)) in enumerate(zip(chunk, certified)):
+                        public_signing_key, identifier = encode.point_to_bytes_33(point), encode.int_to_bytes_8(u.id)
+                        key = certificates.certificate_key(cold_storage_public_key, public_signing_key, identifier)
+                        signature = self.certificate_cache.get(key)
+                        if signature is None:
+                            misses.append((i, key))
+                        else:
+                            certified[i] = exponent, point, (signature, (public_signing_key, identifier))
+
+                future = executor.submit(_sign_worker, [
+                    (encode.point_to_bytes_33(certified[i][1]), chunk[i].id) for i, _ in misses
+                ]) if misses else None
+                signed.append((chunk, certified, misses, future))
+
+            for chunk, certified, misses, future in signed:
+                if future is not None:
+                    for (i, key), certificate in zip(misses, future.result()):
+                        certified[i] = certified[i][:2] + (certificate, )
+                        self.certificate_cache[key] = certificate[0]
+
+                for u, (exponent, _, certificate) in zip(chunk, certified):
+                    self._set_signing_key(u, exponent, certificate)
+
+    def _worker_copy(self) -> 'Arcula':
+        scheme = super()._worker_copy()
+        scheme._signing_fingerprint, scheme._signing_cache = None, cache.LRUCache(self._signing_cache.maxsize)
+        scheme.certificate_cache, scheme.signer = None, None
+        scheme.signing_keys = ec.SigningKeys(self.curve, self.ec_backend, self.signing_keys._keys.maxsize)
+        return scheme
+
+    def _certifying_key(self, seed: typing.Optional[bytes]) -> typing.Optional[ecdsa.SigningKey]:
+        """
+        Return the cold storage key that certifies new nodes, re-derived from the `seed`; without the `seed`, return
+        `None` and check that the signer of a lazy keygen can certify them instead.
+        """
+        assert self.cold_storage_public_key is not None, 'The wallet has not been set up yet.'
+        if seed is None:
+            assert self.signer is not None and self.signer._certify is not None, \
+                'Without the seed, certificates are issued by the signer of a lazy keygen.'
+            return None
+
+        assert len(seed) == 512 // 8, len(seed)
+        cold_storage_key = self._cold_storage_keys(seed[256 // 8:])
+        assert cold_storage_key.get_verifying_key().to_string() == self.cold_storage_public_key.to_string(), \
+            'The seed does not match the one of the wallet.'
+        return cold_storage_key
+
+    def extend(self, parent: hierarchy.ArculaNode, children: typing.Sequence[hierarchy.ArculaNode],
+               seed: typing.Optional[bytes] = None):
+        """
+        Attach the `children` (and their descendants) to the already derived `parent` node.
+        Only the new nodes get a pair of signing keys and a certificate; the `seed` is required to re-derive the cold
+        storage key that signs them.
+        Without the `seed`, the certificates are deferred to the `signer` of a lazy keygen.
+        """
+        cold_storage_key = self._certifying_key(seed)
+        super().extend(parent, children)
+        self._certify_subtrees(cold_storage_key, children)
+
         del cold_storage_key  # Warning: This does not actually delete the keys from memory.
+
+    def derive_signing_key(self, seed: bytes, path: typing.Sequence[int]) \
+            -> typing.Tuple[ecdsa.SigningKey, typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]:
+        """
+        Derive the signing key and the certificate of a single node, without a full `keygen`.
+
+        The `path` lists the identifiers of the nodes from the root (included) to the target node.
+        Results are kept in a bounded LRU cache, that is reset whenever the `seed` changes; neither the seed nor the
+        cold storage key are retained across calls.
+        """
+        assert len(seed) == 512 // 8, len(seed)
+        path = tuple(path)
+
+        fingerprint = crypto.fingerprint(seed)
+        if fingerprint != self._signing_fingerprint:
+            self._signing_cache.clear()
+            self._signing_fingerprint = fingerprint
+
+        derived = self._signing_cache.get(path)
+        if derived is not None:
+            return derived
+
+        cold_storage_key = self._cold_storage_keys(seed[256 // 8:])
+        self.cold_storage_public_key = cold_storage_key.get_verifying_key()
+        _, _, _, key = self.derive(seed[:256 // 8], path)
+        [(exponent, public_point, certificate)] = self._certify_keys(cold_storage_key, [key], [path[-1]])
+        del cold_storage_key  # Warning: This does not actually delete the keys from memory.
+
+        derived = crypto.ecdsa_signing_key(exponent, public_point, self.curve), certificate
+        self._signing_cache[path] = derived
+        return derived
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A contiguous arena of fixed-width slots for secret key material."""
+
+import mmap
+
+__author__ = 'aldur'
+
+_SLOT_SIZE = 256 // 8
+
+
+class KeyArena:
+    """
+    `n_slots` slots of `slot_size` bytes each, preallocated within a single `bytearray` or, if `anonymous`, within an
+    anonymous memory map (which is not part of the Python heap, and can be released explicitly through `close`).
+
+    Slots are exposed as `memoryview` slices of the arena.
+    """
+
+    def __init__(self, n_slots: int, slot_size: int = _SLOT_SIZE, anonymous: bool = False):
+        assert n_slots > 0 and slot_size > 0
+        self.n_slots = n_slots
+        self.slot_size = slot_size
+        self.anonymous = anonymous
+
+        self._buffer = mmap.mmap(-1, n_slots * slot_size) if anonymous else bytearray(n_slots * slot_size)
+        self._view = memoryview(self._buffer)
+
+    def __len__(self) -> int:
+        return self.n_slots
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = bytes(self._view)  # Neither memory maps nor views can be pickled.
+        del state['_view']
+        return state
+
+    def __setstate__(self, state):
+        buffer = state.pop('_buffer')
+        self.__dict__.update(state)
+        if self.anonymous:
+            self._buffer = mmap.mmap(-1, len(buffer))
+            self._buffer[:] = buffer
+        else:
+            self._buffer = bytearray(buffer)
+        self._view = memoryview(self._buffer)
+
+    def region(self, start: int, stop: int) -> memoryview:
+        """Return a view of the slots from `start` to `stop` (excluded)."""
+        return self._view[start * self.slot_size:stop * self.slot_size]
+
+    def wipe(self):
+        """Overwrite every slot with zeros."""
+        self._view[:] = bytes(len(self._view))
+
+    def close(self):
+        """Wipe the arena and release its memory; views of the arena must have been released before."""
+        self.wipe()
+        self._view.release()
+        if self.anonymous:
+            try:
+                self._buffer.close()
+            except BufferError:  # Some views are still alive.
+                self._view = memoryview(self._buffer)
+                raise
+        self._buffer = bytearray()
+        self._view = memoryview(self._buffer)
+        self.n_slots = 0
@@ -4,14 +4,72 @@
 """Implement a wallet with the structure defined by BIP44."""
 
 import ecdsa
+import functools
 import typing
 
-from . import hierarchy, constants, arcula
+from . import hierarchy, constants, arcula, certificates, dhka
 
 __author__ = 'aldur'
 
 
-def bip44_tree(config: dict, cls=hierarchy.Node) -> hierarchy.Node:
+PathIndex = typing.Dict[typing.Tuple[int, ...], hierarchy.Node]  # Maps parsed paths (see `parse_path`) to nodes.
+Branch = typing.Tuple[int, int, int]  # The parsed path of a public/private branch.
+
+
+def _address_nodes(cls, start: int, count: int, layout: constants.WalletLayout) \
+        -> typing.Tuple[typing.List[hierarchy.Node], typing.List[hierarchy.Node]]:
+    """
+    Create `count` address nodes with consecutive identifiers from `start`, with the given `layout`.
+    Return the nodes to attach to their parent (the branch, or the last address of the chain), and all the nodes.
+    """
+    nodes = [cls(j) for j in range(start, start + count)]
+    if layout == constants.WalletLayout.FLAT:
+        return nodes, nodes
+
+    for u, v in zip(nodes, nodes[1:]):
+        u.edges.append(v)
+    return nodes[:1], nodes
+
+
+def _account_node(cls, coin_type: int, i: int, n_private_addresses: int, n_public_addresses: int,
+                  layout: constants.WalletLayout, index: PathIndex) -> hierarchy.Node:
+    """Return the subtree of the `i`-th account of a coin, adding its nodes to the `index`."""
+    assert n_private_addresses > 0 or n_public_addresses > 0
+    account_node = cls(i)
+    index[(coin_type, i)] = account_node
+
+    public_node = cls(0, 'XPUB')
+    account_node.edges.append(public_node)
+    index[(coin_type, i, 0)] = public_node
+    private_node = cls(1, 'XPRV')
+    account_node.edges.append(private_node)
+    index[(coin_type, i, 1)] = private_node
+
+    for branch_node, n_addresses in ((private_node, n_private_addresses), (public_node, n_public_addresses)):
+        children, nodes = _address_nodes(cls, 0, n_addresses, layout)
+        branch_node.edges.extend(children)
+        index.update(((coin_type, i, branch_node.id, v.id), v) for v in nodes)
+
+    return account_node
+
+
+def _coin_node(cls, coin: str, coin_config: typing.Sequence[typing.Tuple[int, int]],
+               layout: constants.WalletLayout, index: PathIndex) -> hierarchy.Node:
+    """Return the subtree of a `coin`, adding its nodes to the `index`."""
+    assert isinstance(coin, str)
+    assert coin_config
+    coin_node = cls(constants.CoinType[coin].value, coin)
+    index[(coin_node.id, )] = coin_node
+
+    for i, (n_private_addresses, n_public_addresses) in enumerate(coin_config):
+        coin_node.edges.append(
+            _account_node(cls, coin_node.id, i, n_private_addresses, n_public_addresses, layout, index)
+        )
+    return coin_node
+
+
+def bip44_tree(config: dict, cls=hierarchy.Node, path_index: typing.Optional[PathIndex] = None,
+               layout: constants.WalletLayout = constants.WalletLayout.CHAINED) -> hierarchy.Node:
     """
     Return the root node of a BIP44-compatible partially ordered hierarchy.
     https://github.com/bitcoin/bips/blob/master/bip-0044.mediawiki
@@ -28,43 +86,55 @@ def bip44_tree(config: dict, cls=hierarchy.Node) -> hierarchy.Node:
 
     The previous dictionary represents a single coin, BTC.
     There are three accounts, that respectively have 1, 4, and 0 private addresses and 2, 5, and 1 public addresses.
+
+    The `layout` selects whether the addresses of each branch are chained, or all children of the branch (see
+    `constants.WalletLayout`); flat branches have a constant depth, and can be derived in parallel.
+    When a `path_index` is provided, it is filled with the parsed path of each node below the purpose node.
     """
+    index = path_index if path_index is not None else {}
+
     master_node = cls(0, tag='m')
     purpose_node = cls(44 + constants.CryptoConstants.BIP32_HARDENED_INDEX.value, tag="44'")
     master_node.edges.append(purpose_node)
 
     for coin, coin_config in config.items():
-        assert isinstance(coin, str)
-        assert coin_config
-        coin_node = cls(constants.CoinType[coin].value, coin)
-        purpose_node.edges.append(coin_node)
-
-        for i, (n_private_addresses, n_public_addresses) in enumerate(coin_config):
-            assert n_private_addresses > 0 or n_public_addresses > 0
-            account_node = cls(i)
-            coin_node.edges.append(account_node)
-
-            public_node = cls(0, 'XPUB')
-            account_node.edges.append(public_node)
-            private_node = cls(1, 'XPRV')
-            account_node.edges.append(private_node)
-
-            previous_node = private_node
-            for j in range(n_private_addresses):
-                private_address_node = cls(j)
-                previous_node.edges.append(private_address_node)
-                previous_node = private_address_node
-
-            previous_node = public_node
-            for j in range(n_public_addresses):
-                public_address_node = cls(j)
-                previous_node.edges.append(public_address_node)
-                previous_node = public_address_node
+        purpose_node.edges.append(_coin_node(cls, coin, coin_config, layout, index))
 
     return master_node
 
 
-def find_bip44_node_with_path(master: hierarchy.Node, path: str) -> hierarchy.Node:
+@functools.lru_cache(maxsize=1024)
+def parse_path(path: str) -> typing.Tuple[int, ...]:
+    """
+    Parse a BIP44 `path` (see `find_bip44_node_with_path`) to the indexes of its coin, account, public/private branch,
+    and address.
+    Parsed paths are cached.
+    """
+    assert path and path.startswith("m/44'")
+    path = path[len("m/44'/"):].strip('/')
+    path = path.upper()
+    path = path.split("/")
+    path[0] = constants.CoinType[path[0]]  # Convert the coin to its corresponding index.
+    path = [0 if i == 'XPUB' else i for i in path]  # Convert the public/private branches to their indexes.
+    path = [1 if i == 'XPRIV' else i for i in path]
+    return tuple(int(i) for i in path)
+
+
+def derivation_path(path: str, layout: constants.WalletLayout = constants.WalletLayout.CHAINED) \
+        -> typing.Tuple[int, ...]:
+    """
+    Return the identifiers of the nodes from the master node (included) to the node at the BIP44 `path` within a
+    hierarchy with the given `layout`, as taken by `DHKA.derive` and `Arcula.derive_signing_key`.
+    """
+    path = parse_path(path)
+    prefix = (0, 44 + constants.CryptoConstants.BIP32_HARDENED_INDEX.value) + path[:3]
+    if len(path) < 4 or layout == constants.WalletLayout.FLAT:
+        return prefix + path[3:]
+    return prefix + tuple(range(path[3] + 1))
+
+
+def find_bip44_node_with_path(master: hierarchy.Node, path: str, path_index: typing.Optional[PathIndex] = None,
+                              layout: constants.WalletLayout = constants.WalletLayout.CHAINED) -> hierarchy.Node:
     """
     Take the `master` node of a BIP44 hierarchy and a `path` and return the corresponding node.
 
@@ -79,16 +149,18 @@ def find_bip44_node_with_path(master: hierarchy.Node, path: str) -> hierarchy.No
         m/44'/BTC/2/xpub/5
 
     Any suffix of a string that starts with "m/44'" is considered valid.
+    The `layout` of the addresses of the hierarchy is the one it has been built with (see `constants.WalletLayout`).
+
+    The `path_index` built by `bip44_tree` finds the node in constant time; without it (or for the paths it does not
+    hold), the hierarchy is walked down from the `master` node.
     """
-    assert path and path.startswith("m/44'")
-    path = path[len("m/44'/"):]
-    path.strip('/')
-    path = path.upper()
-    path = path.split("/")
-    path[0] = constants.CoinType[path[0]]  # Convert the coin to its corresponding index.
-    path = [0 if i == 'XPUB' else i for i in path]  # Convert the public/private branches to their indexes.
-    path = [1 if i == 'XPRIV' else i for i in path]
-    path = [int(i) for i in path]
+    path = parse_path(path)
+    if path_index is not None:
+        node = path_index.get(path)
+        if node is not None:
+            return node
+
+    path = list(path)
 
     assert master is not None
     assert master.id == 0 and master.tag == "m"
@@ -117,19 +189,57 @@ def find_bip44_node_with_path(master: hierarchy.Node, path: str) -> hierarchy.No
     if not path:
         return master
 
-    for _ in range(path.pop(0) + 1):  # Go down the chain until the i-th account.
-        master = master.edges[0]
+    if layout == constants.WalletLayout.FLAT:
+        master = master.edges[path.pop(0)]
+    else:
+        for _ in range(path.pop(0) + 1):  # Go down the chain until the i-th account.
+            master = master.edges[0]
 
     assert not path
     return master
 
 
 class ArculaBIP44:
-    """A Secure, Hierarchical Deterministic Wallet."""
-    def __init__(self, seed: bytes, config: dict):
-        root: hierarchy.ArculaNode = bip44_tree(config, cls=hierarchy.ArculaNode)
-        self.arcula = arcula.Arcula(root)
-        self.arcula.keygen(seed)
+    """
+    A Secure, Hierarchical Deterministic Wallet.
+    The optional `certificate_cache` stores the certificates across runs, so that they are only signed once.
+    When `lazy`, the certificates are only issued when first requested (see `Arcula.keygen`).
+    `retention` selects the key material that the nodes retain (see `dhka.Retention`), and `edge_encryption` when
+    the edges are encrypted (see `dhka.EdgeEncryption`).
+    `layout` selects the layout of the addresses (see `constants.WalletLayout`).
+
+    When a `gap_limit` is provided, each public/private branch starts with at least `gap_limit` addresses, and keeps
+    at least `gap_limit` unused addresses after the last used one (see `mark_used` and `next_address`), deriving new
+    addresses in batches as they get used.
+    The `config` can later be changed through `update`.
+    New nodes are certified by the `seed`, if provided, or by the signer of a `lazy` wallet.
+    """
+    def __init__(self, seed: bytes, config: dict,
+                 certificate_cache: typing.Optional[certificates.CertificateCache] = None, lazy: bool = False,
+                 retention: dhka.Retention = dhka.Retention.FULL,
+                 edge_encryption: dhka.EdgeEncryption = dhka.EdgeEncryption.EAGER,
+                 layout: constants.WalletLayout = constants.WalletLayout.CHAINED,
+                 gap_limit: typing.Optional[int] = None):
+        assert gap_limit is None or gap_limit > 0
+        assert gap_limit is None or retention is dhka.Retention.FULL, 'New addresses are derived from the secrets.'
+        self.layout = layout
+        self.gap_limit = gap_limit
+        self.config = {coin: tuple(tuple(account) for account in coin_config) for coin, coin_config in config.items()}
+        config = {coin: self._with_gap_limit(coin_config) for coin, coin_config in self.config.items()}
+        self.address_counts: typing.Dict[Branch, int] = {}  # The number of addresses of each branch.
+        self.last_used: typing.Dict[Branch, int] = {}  # The index of the last used address of each branch.
+        for coin, coin_config in config.items():
+            for i, account in enumerate(coin_config):
+                self._count_addresses(constants.CoinType[coin].value, i, account)
+
+        self.path_index: PathIndex = {}
+        root: hierarchy.ArculaNode = bip44_tree(
+            config, cls=hierarchy.ArculaNode, path_index=self.path_index, layout=layout
+        )
+        self.arcula = arcula.Arcula(
+            root, certificate_cache=certificate_cache, retention=retention, edge_encryption=edge_encryption
+        )
+        self.arcula.keygen(seed, lazy=lazy)
 
     def get_cold_storage_public_key(self) -> ecdsa.VerifyingKey:
         """Return the cold storage public key corresponding to the wallet."""
@@ -137,9 +247,160 @@ class ArculaBIP44:
 
     def get_signing_key_certificate(self, path: str) -> typing.Tuple[ecdsa.SigningKey, typing.Tuple]:
         """Return the signing key of the node at `path` and its authorization certificate."""
-        node = find_bip44_node_with_path(self.arcula.root, path)
+        node = find_bip44_node_with_path(self.arcula.root, path, self.path_index, self.layout)
         return node._signing_key, node.certificate
 
+    def _count_addresses(self, coin_type: int, i: int, account: typing.Tuple[int, int]):
+        n_private_addresses, n_public_addresses = account
+        self.address_counts[(coin_type, i, 1)] = n_private_addresses
+        self.address_counts[(coin_type, i, 0)] = n_public_addresses
+
+    def _with_gap_limit(self, coin_config: typing.Sequence[typing.Tuple[int, int]]) -> typing.Tuple[tuple, ...]:
+        """Raise the number of addresses of each branch of `coin_config` to the gap limit."""
+        gap_limit = self.gap_limit or 0
+        return tuple((max(n_private, gap_limit), max(n_public, gap_limit)) for n_private, n_public in coin_config)
+
+    def _address_parent(self, branch: Branch, j: int) -> hierarchy.Node:
+        """Return the node that the `j`-th address of the `branch` is attached to."""
+        chained = self.layout == constants.WalletLayout.CHAINED
+        return self.path_index[branch + (j - 1, ) if chained and j else branch]
+
+    def _resize_branch(self, branch: Branch, count: int, seed: typing.Optional[bytes] = None):
+        """Derive new addresses at the end of the `branch`, or drop its last ones, until it holds `count` addresses."""
+        n_addresses = self.address_counts[branch]
+        chained = self.layout == constants.WalletLayout.CHAINED
+        assert self.last_used.get(branch, -1) < count, 'Used addresses cannot be dropped.'
+
+        if count > n_addresses:
+            parent = self._address_parent(branch, n_addresses)
+            children, nodes = _address_nodes(hierarchy.ArculaNode, n_addresses, count - n_addresses, self.layout)
+            self.arcula.extend(parent, children, seed)
+            self.path_index.update((branch + (v.id, ), v) for v in nodes)
+
+        elif count < n_addresses:
+            self.arcula.truncate(self._address_parent(branch, count), 0 if chained else count)
+            for j in range(count, n_addresses):
+                del self.path_index[branch + (j, )]
+
+        self.address_counts[branch] = count
+
+    def _forget_account(self, coin_type: int, i: int):
+        """Remove the nodes of the `i`-th account of a coin, that has been detached, from the index."""
+        for branch in ((coin_type, i, 1), (coin_type, i, 0)):
+            for j in range(self.address_counts.pop(branch)):
+                del self.path_index[branch + (j, )]
+            del self.path_index[branch]
+            self.last_used.pop(branch, None)
+        del self.path_index[(coin_type, i)]
+
+    def update(self, config: dict, seed: typing.Optional[bytes] = None):
+        """
+        Reconcile the wallet with a new `config`, as taken by `bip44_tree`: derive the coins, accounts, and addresses
+        that have been added, and drop the ones that have been removed.
+        The keys and the certificates of the other nodes are left untouched.
+
+        Accounts are identified by their position, so that only the last ones can be removed.
+        Branches are resized from their current number of addresses, and never drop the used ones (nor the unused ones
+        within the gap limit).
+        The whole change is checked before it is applied, so that a failed update leaves the wallet untouched.
+        """
+        config = {coin: tuple(tuple(account) for account in coin_config) for coin, coin_config in config.items()}
+        for coin, coin_config in config.items():
+            assert coin in constants.CoinType.__members__, f'Unknown coin {coin}.'
+            assert coin_config and all(n_private > 0 or n_public > 0 for n_private, n_public in coin_config), \
+                f'Each account of {coin} should have at least an address.'
+
+        # Plan the change.
+        purpose_node = self.arcula.root.edges[0]
+        removed_coins = [coin for coin in self.config if coin not in config]
+        added_coins = [coin for coin in config if coin not in self.config]
+        removed_accounts, added_accounts, resized_branches = [], [], []
+        for coin, coin_config in config.items():
+            if coin in added_coins:
+                continue
+
+            coin_type, n_accounts = constants.CoinType[coin].value, len(self.config[coin])
+            removed_accounts.append((coin_type, len(coin_config), n_accounts))
+            added_accounts.append((coin_type, list(enumerate(self._with_gap_limit(coin_config)))[n_accounts:]))
+            for i, (n_private, n_public) in enumerate(coin_config[:n_accounts]):
+                for branch, count in (((coin_type, i, 1), n_private), ((coin_type, i, 0), n_public)):
+                    count = max(count, self.last_used.get(branch, -1) + 1 + (self.gap_limit or 0))
+                    resized_branches.append((branch, count))
+
+        parents = [purpose_node] if added_coins else []  # The nodes that new nodes are attached to.
+        parents += [self.path_index[(coin_type, )] for coin_type, accounts in added_accounts if accounts]
+        parents += [
+            self._address_parent(branch, self.address_counts[branch])
+            for branch, count in resized_branches if count > self.address_counts[branch]
+        ]
+        if parents:
+            self.arcula._certifying_key(seed)
+            assert all(u._secret is not None for u in parents), \
+                'New nodes are derived from the secrets of their parents, that have not been retained.'
+
+        # Apply it.
+        for coin in removed_coins:
+            coin_type = constants.CoinType[coin].value
+            self.arcula.detach(purpose_node, self.path_index[(coin_type, )])
+            for i in range(len(self.config[coin])):
+                self._forget_account(coin_type, i)
+            del self.path_index[(coin_type, )]
+
+        for coin_type, n_accounts, n_old_accounts in removed_accounts:
+            if n_accounts < n_old_accounts:
+                self.arcula.truncate(self.path_index[(coin_type, )], n_accounts)
+                for i in range(n_accounts, n_old_accounts):
+                    self._forget_account(coin_type, i)
+
+        for branch, count in resized_branches:
+            self._resize_branch(branch, count, seed)
+
+        for coin_type, accounts in added_accounts:
+            if accounts:
+                self.arcula.extend(self.path_index[(coin_type, )], [
+                    _account_node(hierarchy.ArculaNode, coin_type, i, *account, self.layout, self.path_index)
+                    for i, account in accounts
+                ], seed)
+                for i, account in accounts:
+                    self._count_addresses(coin_type, i, account)
+
+        for coin in added_coins:
+            coin_type, coin_config = constants.CoinType[coin].value, self._with_gap_limit(config[coin])
+            self.arcula.extend(
+                purpose_node, [_coin_node(hierarchy.ArculaNode, coin, coin_config, self.layout, self.path_index)], seed
+            )
+            for i, account in enumerate(coin_config):
+                self._count_addresses(coin_type, i, account)
+
+        self.config = config
+
+    def mark_used(self, path: str, seed: typing.Optional[bytes] = None):
+        """
+        Record that the address at `path` has been used, deriving it if needed, and keep the gap limit of its branch.
+        The `seed` certifies the new addresses of a wallet that is not `lazy`.
+        """
+        *branch, index = parse_path(path)
+        branch = tuple(branch)
+        assert branch in self.address_counts, 'The path should select an address.'
+
+        if index > self.last_used.get(branch, -1):
+            self.last_used[branch] = index
+
+        count, n_addresses = self.last_used[branch] + 1 + (self.gap_limit or 0), self.address_counts[branch]
+        if count > n_addresses:
+            self._resize_branch(branch, max(count, n_addresses + (self.gap_limit or 0)), seed)  # A whole batch.
+
+    def next_address(self, path: str, seed: typing.Optional[bytes] = None) -> str:
+        """
+        Take the `path` of a public/private branch, mark the first address after its last used one as used, and
+        return the path of the address.
+        """
+        branch = parse_path(path)
+        assert branch in self.address_counts, 'The path should select a public/private branch.'
+        address = f'{path.rstrip("/")}/{self.last_used.get(branch, -1) + 1}'
+        self.mark_used(address, seed)
+        return address
+
 
 def main():
     pass
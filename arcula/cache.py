@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Bounded caches."""
+
+import collections
+import typing
+
+__author__ = 'aldur'
+
+
+class LRUCache:
+    """A dictionary-like cache that holds up to `maxsize` items and evicts the least recently used one."""
+
+    def __init__(self, maxsize: int = 1024):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self._data: typing.OrderedDict = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        """Return the value for `key` (marking it as recently used) or `default`."""
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        """Remove every item from the cache."""
+        self._data.clear()
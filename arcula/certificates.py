@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A persistent cache of the authorization certificates of Arcula."""
+
+import dbm
+import typing
+
+__author__ = 'aldur'
+
+
+def certificate_key(cold_storage_public_key: bytes, public_signing_key: bytes, identifier: bytes) -> bytes:
+    """
+    Return the key of a certificate within the cache: the concatenation of the 33 bytes compressed
+    `cold_storage_public_key` and `public_signing_key`, and of the 8 bytes `identifier`.
+    """
+    assert len(cold_storage_public_key) == 33 and len(public_signing_key) == 33 and len(identifier) == 8
+    return cold_storage_public_key + public_signing_key + identifier
+
+
+class CertificateCache:
+    """
+    Map the cold storage public keys, the signing keys, and the identifiers to the signatures that certify them.
+    As certificates are deterministic, the signature of a key never changes and can be stored across runs.
+
+    Signatures are kept in memory or, if a `path` is provided, in a `dbm` database.
+    The cache is trusted: its signatures are not verified when read (see `Arcula.audit`).
+    """
+
+    def __init__(self, path: typing.Optional[str] = None):
+        self.path = path
+        self._data = dbm.open(path, 'c') if path is not None else {}
+
+    def get(self, key: bytes) -> typing.Optional[bytes]:
+        """Return the signature stored for `key`, if any."""
+        return self._data.get(key)
+
+    def __setitem__(self, key: bytes, signature: bytes):
+        self._data[key] = signature
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def close(self):
+        """Write the signatures to disk and close the database."""
+        if self.path is not None:
+            self._data.close()
+
+    def __enter__(self) -> 'CertificateCache':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A persistent store of the secrets of the DHKA at regular depths, to resume the derivation of deep nodes."""
+
+import dbm
+import hashlib
+import struct
+import typing
+
+__author__ = 'aldur'
+
+_FINGERPRINT_KEY = b'fingerprint'
+
+
+class CheckpointStore:
+    """
+    Store the secret of each node whose depth is a multiple of `interval`, as met by `DHKA.derive`, so that the
+    derivation of a node resumes from the deepest checkpoint along its path, at most `interval` PRF steps away.
+    Larger intervals store fewer secrets, at the cost of longer derivations.
+
+    Secrets are kept in memory or, if a `path` is provided, in a `dbm` database; the store is bound to the seed of
+    the first derivation (see `bind`).
+    Warning: checkpoints are as sensitive as the seed, as they allow the derivation of whole subtrees.
+    """
+
+    def __init__(self, interval: int = 64, path: typing.Optional[str] = None):
+        assert interval > 0
+        self.interval = interval
+        self.path = path
+        self._data = dbm.open(path, 'c') if path is not None else {}
+
+    def bind(self, seed: bytes):
+        """Bind an empty store to the `seed`, or check that the store is bound to it."""
+        fingerprint = hashlib.sha256(b'arcula-checkpoints' + seed).digest()
+        stored = self._data.get(_FINGERPRINT_KEY)
+        if stored is None:
+            self._data[_FINGERPRINT_KEY] = fingerprint
+        else:
+            assert stored == fingerprint, 'The checkpoints belong to a different seed.'
+
+    def keys(self, identifiers: typing.Sequence[int]) -> typing.List[bytes]:
+        """
+        Return the keys of the checkpoints along the path of `identifiers` from the root (included): the i-th key
+        refers to the node at depth `(i + 1) * interval`.
+        The path is hashed once, so that the cost of each key does not depend on its depth.
+        """
+        packed = struct.pack(f'>{len(identifiers)}Q', *identifiers)
+        step = 8 * self.interval
+        h = hashlib.sha256()
+        keys = []
+        for offset in range(step, len(packed) + 1, step):
+            h.update(packed[offset - step:offset])
+            keys.append(h.copy().digest())
+        return keys
+
+    def get(self, key: bytes) -> typing.Optional[bytes]:
+        """Return the secret stored for `key`, if any."""
+        return self._data.get(key)
+
+    def __setitem__(self, key: bytes, secret: bytes):
+        self._data[key] = secret
+
+    def __len__(self) -> int:
+        return len(self._data) - (_FINGERPRINT_KEY in self._data)
+
+    def close(self):
+        """Write the checkpoints to disk and close the database."""
+        if self.path is not None:
+            self._data.close()
+
+    def __enter__(self) -> 'CheckpointStore':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A compact, struct-of-arrays representation of large hierarchies.
+
+Nodes are numbered in breadth-first order, so that the children of each node are contiguous: their offsets are stored
+in CSR form, and the fixed-width key material of all nodes lives in a few contiguous buffers.
+The secrets, encryption keys and private keys share a single `arena.KeyArena`, which can be wiped in one call.
+`Node` views expose the attributes of the `hierarchy` nodes on top of them, so that the DHKA and Arcula can run
+`keygen` directly on a `CompactHierarchy`.
+"""
+
+import array
+import typing
+
+from . import arena, encode, crypto
+if typing.TYPE_CHECKING:
+    from . import ec, hierarchy
+
+__author__ = 'aldur'
+
+_KEY_SIZE = 256 // 8  # The width of the secrets, encryption keys, and private keys.
+_PUBLIC_KEY_SIZE = 33
+_SIGNATURE_SIZE = 72  # The maximum width of a DER signature over a 256 bits curve.
+
+Buffer = typing.Union[bytearray, memoryview]
+
+
+def _index_array(n: int, values: typing.Iterable[int] = ()) -> array.array:
+    """Return an array of node indexes, as narrow as `n` nodes allow."""
+    return array.array('I' if n < 2 ** 32 else 'Q', values)
+
+
+class CompactHierarchy:
+    """
+    A tree of `len(ids)` nodes in breadth-first order, where the i-th node has identifier `ids[i]` and
+    `n_children[i]` children; `tags` optionally maps the index of some nodes to their tag.
+
+    The key material is stored in contiguous buffers, each holding a fixed-width slot per node; the secret ones are
+    regions of `key_material`, held within an anonymous memory map if `anonymous`.
+    Encrypted edges are stored within the slot of the child they reach; their width is fixed by the first one.
+    """
+
+    def __init__(self, ids: typing.Iterable[int], n_children: typing.Iterable[int],
+                 tags: typing.Optional[typing.Dict[int, str]] = None, anonymous: bool = False):
+        self.ids = array.array('Q', ids)
+        n = len(self.ids)
+        assert n > 0
+
+        self.offsets = _index_array(n + 1, [1])  # The children of `i` are the nodes in `offsets[i]:offsets[i + 1]`.
+        self.parents = _index_array(n, [0])  # The root is its own parent.
+        for i, count in enumerate(n_children):
+            self.offsets.append(self.offsets[-1] + count)
+            self.parents.extend([i] * count)
+        assert len(self.offsets) == n + 1 and self.offsets[-1] == n, 'The shape does not describe a tree.'
+
+        self.tags = dict(tags or {})
+
+        self.key_material = arena.KeyArena(3 * n, _KEY_SIZE, anonymous)
+        self._key_regions()
+        self.public_keys = bytearray(n * _PUBLIC_KEY_SIZE)
+        self.signatures = bytearray(n * _SIGNATURE_SIZE)
+        self.signature_lengths = array.array('B', bytes(n))  # Zero for the nodes without a certificate.
+
+        self.edge_widths: typing.Optional[typing.Tuple[int, int]] = None  # The width of the nonces and the ciphers.
+        self.edges = bytearray()
+
+        self.signing_keys: typing.Optional['ec.SigningKeys'] = None  # Builds the signing keys from their scalars.
+        self.certificate_issuer: typing.Optional[typing.Callable[['Node'], tuple]] = None
+        self.edge_encrypter: typing.Optional[typing.Callable[['Node', int], list]] = None  # Encrypts deferred edges.
+
+    def _key_regions(self):
+        n = len(self)
+        self.secrets = self.key_material.region(0, n)
+        self.encryption_keys = self.key_material.region(n, 2 * n)
+        self.keys = self.key_material.region(2 * n, 3 * n)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('secrets', 'encryption_keys', 'keys'):  # Views cannot be pickled.
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._key_regions()
+
+    @classmethod
+    def from_shape(cls, tree_shape: typing.Iterable[typing.Tuple[int, int]],
+                   tags: typing.Optional[typing.Dict[int, str]] = None, anonymous: bool = False) -> 'CompactHierarchy':
+        """Build a compact hierarchy from its shape (see `hierarchy.shape`)."""
+        ids, n_children = array.array('Q'), []
+        for identifier, count in tree_shape:
+            ids.append(identifier)
+            n_children.append(count)
+        return cls(ids, n_children, tags, anonymous)
+
+    @classmethod
+    def from_root(cls, root: 'hierarchy.Node', anonymous: bool = False) -> 'CompactHierarchy':
+        """Build a compact hierarchy with the structure of the tree rooted at `root` (the keys are not copied)."""
+        from . import hierarchy
+        nodes = list(hierarchy.breadth_first(root))
+        return cls(
+            (u.id for u in nodes), (len(u.edges) for u in nodes),
+            {i: u.tag for i, u in enumerate(nodes) if u.tag is not None}, anonymous
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def root(self) -> 'Node':
+        return Node(self, 0)
+
+    def node(self, i: int) -> 'Node':
+        """Return a view of the `i`-th node."""
+        return Node(self, i)
+
+    def children(self, i: int) -> range:
+        """Return the indexes of the children of the `i`-th node."""
+        return range(self.offsets[i], self.offsets[i + 1])
+
+    def parent(self, i: int) -> typing.Optional[int]:
+        """Return the index of the parent of the `i`-th node (`None` for the root)."""
+        return self.parents[i] if i else None
+
+    def key_views(self, i: int) -> typing.Tuple[memoryview, memoryview, memoryview]:
+        """Return zero-copy views of the secret, the encryption key, and the private key of the `i`-th node."""
+        start, stop = i * _KEY_SIZE, (i + 1) * _KEY_SIZE
+        return self.secrets[start:stop], self.encryption_keys[start:stop], self.keys[start:stop]
+
+    def wipe(self):
+        """Erase the key material of every node, and forget the cached signing keys."""
+        self.key_material.wipe()
+        if self.signing_keys is not None:
+            self.signing_keys.clear()
+
+    def close(self):
+        """Wipe the key material and release its memory; views returned by `key_views` must have been released."""
+        self.wipe()
+        for region in (self.secrets, self.encryption_keys, self.keys):
+            region.release()
+        try:
+            self.key_material.close()
+        except BufferError:
+            self._key_regions()
+            raise
+
+    def get(self, buffer: Buffer, i: int, width: int = _KEY_SIZE) -> typing.Optional[bytes]:
+        """Return the slot of the `i`-th node within `buffer`, or `None` if it has not been assigned."""
+        value = bytes(buffer[i * width:(i + 1) * width])
+        return value if any(value) else None
+
+    def set(self, buffer: Buffer, i: int, value: typing.Optional[bytes], width: int = _KEY_SIZE):
+        """Assign the slot of the `i`-th node within `buffer` (`None` clears it)."""
+        buffer[i * width:(i + 1) * width] = bytes(width) if value is None else value
+        assert len(buffer) == len(self) * width
+
+    def has_edge(self, i: int) -> bool:
+        """Return whether the encrypted edge that reaches the `i`-th node has been assigned."""
+        if self.edge_widths is None:
+            return False
+        width = sum(self.edge_widths)
+        return any(self.edges[(i - 1) * width:i * width])
+
+    def get_edge(self, i: int) -> typing.Tuple[bytes, bytes]:
+        """Return the encrypted edge that reaches the `i`-th node from its parent."""
+        nonce_width, cipher_width = self.edge_widths
+        offset = (i - 1) * (nonce_width + cipher_width)
+        return bytes(self.edges[offset:offset + nonce_width]), \
+            bytes(self.edges[offset + nonce_width:offset + nonce_width + cipher_width])
+
+    def set_edge(self, i: int, edge: typing.Tuple[bytes, bytes]):
+        """Assign the encrypted edge that reaches the `i`-th node from its parent."""
+        nonce, cipher = edge
+        if self.edge_widths is None:
+            self.edge_widths = len(nonce), len(cipher)
+            self.edges = bytearray((len(self) - 1) * (len(nonce) + len(cipher)))
+        assert (len(nonce), len(cipher)) == self.edge_widths, 'Encrypted edges should have a fixed width.'
+
+        offset = (i - 1) * (len(nonce) + len(cipher))
+        self.edges[offset:offset + len(nonce) + len(cipher)] = nonce + cipher
+
+    def get_certificate(self, i: int) -> typing.Optional[typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]:
+        """Return the certificate of the `i`-th node, or `None` if it has not been issued."""
+        length = self.signature_lengths[i]
+        if not length:
+            return None
+        signature = bytes(self.signatures[i * _SIGNATURE_SIZE:i * _SIGNATURE_SIZE + length])
+        public_key = bytes(self.public_keys[i * _PUBLIC_KEY_SIZE:(i + 1) * _PUBLIC_KEY_SIZE])
+        return signature, (public_key, encode.int_to_bytes_8(self.ids[i]))
+
+    def set_certificate(self, i: int, certificate: typing.Optional[typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]):
+        """Assign the certificate of the `i`-th node (`None` clears it)."""
+        if certificate is None:
+            self.signature_lengths[i] = 0
+            return
+
+        signature, (public_key, identifier) = certificate
+        assert len(signature) <= _SIGNATURE_SIZE and identifier == encode.int_to_bytes_8(self.ids[i])
+        self.signatures[i * _SIGNATURE_SIZE:i * _SIGNATURE_SIZE + len(signature)] = signature
+        self.set(self.public_keys, i, public_key, _PUBLIC_KEY_SIZE)
+        self.signature_lengths[i] = len(signature)
+
+
+class Node:
+    """A view of a node of a `CompactHierarchy`, exposing the attributes of `hierarchy.ArculaNode`."""
+
+    __slots__ = ('hierarchy', 'index')
+
+    def __init__(self, compact_hierarchy: CompactHierarchy, index: int):
+        self.hierarchy = compact_hierarchy
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Node) and self.hierarchy is other.hierarchy and self.index == other.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.hierarchy), self.index))
+
+    def __repr__(self) -> str:
+        return f'{self.id}' if self.tag is None else f'{self.tag}'
+
+    def __str__(self) -> str:
+        return self.__repr__()
+
+    @property
+    def id(self) -> int:
+        return self.hierarchy.ids[self.index]
+
+    @property
+    def tag(self) -> typing.Optional[str]:
+        return self.hierarchy.tags.get(self.index)
+
+    @property
+    def edges(self) -> typing.List['Node']:
+        return [Node(self.hierarchy, j) for j in self.hierarchy.children(self.index)]
+
+    @property
+    def encrypted_edges(self) -> typing.List[typing.Tuple[bytes, bytes]]:
+        """The encrypted edges to the children; if they have been deferred, they are encrypted on first access."""
+        tree, children = self.hierarchy, self.hierarchy.children(self.index)
+        if not children:
+            return []
+        if not tree.has_edge(children[0]):
+            if tree.edge_encrypter is None:
+                return []
+            for j, edge in zip(children, tree.edge_encrypter(self, 0)):
+                tree.set_edge(j, edge)
+        return [tree.get_edge(j) for j in children]
+
+    @property
+    def _label(self) -> bytes:
+        return encode.int_to_bytes_8(self.id)
+
+    @_label.setter
+    def _label(self, label: bytes):
+        assert label == self._label  # Labels are not stored, as they are the encoding of the identifiers.
+
+    @property
+    def _secret(self) -> typing.Optional[bytes]:
+        return self.hierarchy.get(self.hierarchy.secrets, self.index)
+
+    @_secret.setter
+    def _secret(self, secret: typing.Optional[bytes]):
+        self.hierarchy.set(self.hierarchy.secrets, self.index, secret)
+
+    @property
+    def _encryption_key(self) -> typing.Optional[bytes]:
+        return self.hierarchy.get(self.hierarchy.encryption_keys, self.index)
+
+    @_encryption_key.setter
+    def _encryption_key(self, encryption_key: typing.Optional[bytes]):
+        self.hierarchy.set(self.hierarchy.encryption_keys, self.index, encryption_key)
+
+    @property
+    def _key(self) -> typing.Optional[bytes]:
+        return self.hierarchy.get(self.hierarchy.keys, self.index)
+
+    @_key.setter
+    def _key(self, key: typing.Optional[bytes]):
+        self.hierarchy.set(self.hierarchy.keys, self.index, key)
+
+    @property
+    def _signing_scalar(self) -> typing.Optional[bytes]:
+        """The secret scalar of the signing key; not stored, as it is derived from the private key."""
+        key, signing_keys = self._key, self.hierarchy.signing_keys
+        if key is None or signing_keys is None:
+            return None
+        return encode.int_to_bytes_32(crypto.ecdsa_exponent(key, signing_keys.curve))
+
+    @_signing_scalar.setter
+    def _signing_scalar(self, scalar: bytes):
+        pass  # It will be derived again from the private key.
+
+    @property
+    def _signing_keys(self) -> typing.Optional['ec.SigningKeys']:
+        return self.hierarchy.signing_keys
+
+    @_signing_keys.setter
+    def _signing_keys(self, signing_keys: 'ec.SigningKeys'):
+        self.hierarchy.signing_keys = signing_keys
+
+    @property
+    def _signing_key(self):
+        scalar = self._signing_scalar
+        return None if scalar is None else self.hierarchy.signing_keys.get(scalar)
+
+    @property
+    def certificate(self) -> typing.Optional[typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]:
+        """The certificate of the node; if it has been deferred, it is issued on first access and memoized."""
+        certificate = self.hierarchy.get_certificate(self.index)
+        if certificate is None and self.hierarchy.certificate_issuer is not None:
+            certificate = self.hierarchy.certificate_issuer(self)
+            self.hierarchy.set_certificate(self.index, certificate)
+        return certificate
+
+    @certificate.setter
+    def certificate(self, certificate: typing.Optional[typing.Tuple[bytes, typing.Tuple[bytes, bytes]]]):
+        self.hierarchy.set_certificate(self.index, certificate)
+
+    @property
+    def _certificate_issuer(self) -> typing.Optional[typing.Callable[['Node'], tuple]]:
+        return self.hierarchy.certificate_issuer
+
+    @_certificate_issuer.setter
+    def _certificate_issuer(self, issuer: typing.Optional[typing.Callable[['Node'], tuple]]):
+        self.hierarchy.certificate_issuer = issuer
+
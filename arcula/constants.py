@@ -19,6 +19,16 @@ class CryptoConstants(enum.Enum):
     PRF_SECRET_PREFIX = b'\x03'
 
 
+class WalletLayout(enum.IntEnum):
+    """
+    The versions of the layout of the addresses of BIP44 wallets:
+    1. `CHAINED`: each address is the child of the previous one (the first is the child of its public/private branch).
+    2. `FLAT`: each address is a child of its public/private branch.
+    """
+    CHAINED = 1
+    FLAT = 2
+
+
 class CoinType(enum.IntEnum):
     """
     BIP44 coin type specifications.
@@ -11,6 +11,9 @@ import ecdsa
 
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+if typing.TYPE_CHECKING:
+    from . import ec
+
 __author__ = 'aldur'
 
 
@@ -21,6 +24,11 @@ def sha3_512(m: bytes) -> bytes:
     return h.digest()
 
 
+def fingerprint(m: bytes) -> bytes:
+    """Return a digest that identifies the secret `m` without revealing it (domain separated from the PRFs)."""
+    return hashlib.sha256(b'arcula-fingerprint' + m).digest()
+
+
 def sha3_512_half(m: bytes) -> bytes:
     """Return the SHA3_512_half digest of the provided message."""
     h = hashlib.sha3_512()
@@ -34,6 +42,28 @@ def sha3_512_half_k(k: bytes, m: bytes) -> bytes:
     return sha3_512_half(k + m)
 
 
+def sha3_512_half_k_batch(k: bytes, ms: typing.Sequence[bytes]) -> typing.List[bytes]:
+    """
+    Use SHA3_512 as a PRF, with key `k`, for each of the messages `ms`.
+    The key is absorbed once and the hash state is copied for each message.
+    """
+    h = hashlib.sha3_512(k)
+    digests = []
+    for m in ms:
+        h_m = h.copy()
+        h_m.update(m)
+        digests.append(h_m.digest()[:512 // 8 // 2])
+    return digests
+
+
+def prf_batch(prf_f: typing.Callable[[bytes, bytes], bytes], k: bytes, ms: typing.Sequence[bytes]) \
+        -> typing.List[bytes]:
+    """Evaluate the PRF `prf_f`, with key `k`, for each of the messages `ms`."""
+    if prf_f is sha3_512_half_k:
+        return sha3_512_half_k_batch(k, ms)
+    return [prf_f(k, m) for m in ms]
+
+
 def aes_ae(k: bytes, m: bytes) -> typing.Tuple[bytes, bytes]:
     """Authenticated AES Encryption of message `m` with key `k`."""
     assert len(k) == 256 // 8
@@ -48,17 +78,59 @@ def aes_ad(k: bytes, c: typing.Tuple[bytes, bytes]) -> bytes:
     return AESGCM(k).decrypt(*c, None)
 
 
-def ecdsa_keygen(seed: bytes, curve: ecdsa.curves.Curve) -> ecdsa.SigningKey:
-    """Deterministically generate an ECDSA signing key from a `seed `of bytes."""
+def ecdsa_keygen(seed: bytes, curve: ecdsa.curves.Curve, backend: typing.Optional['ec.Backend'] = None) \
+        -> ecdsa.SigningKey:
+    """
+    Deterministically generate an ECDSA signing key from a `seed `of bytes.
+    If provided, the EC `backend` computes the public key.
+    """
+    exponent = ecdsa_exponent(seed, curve)
+    if backend is None:
+        return ecdsa.SigningKey.from_secret_exponent(exponent, curve)
+
+    assert backend.curve == curve
+    return ecdsa_signing_key(exponent, backend.public_point(exponent), curve)
+
+
+def ecdsa_exponent(seed: bytes, curve: ecdsa.curves.Curve) -> int:
+    """Deterministically generate the secret exponent of an ECDSA signing key from a `seed` of bytes."""
     assert len(seed) == 256 // 8
-    exponent = ecdsa.util.randrange_from_seed__trytryagain(seed, curve.order)
-    return ecdsa.SigningKey.from_secret_exponent(exponent, curve)
+    return ecdsa.util.randrange_from_seed__trytryagain(seed, curve.order)
 
 
-def ecdsa_sign(k: ecdsa.SigningKey, message: bytes) -> bytes:
+def ecdsa_signing_key(exponent: int, public_point: typing.Tuple[int, int], curve: ecdsa.curves.Curve) \
+        -> ecdsa.SigningKey:
     """
-    Generate an ECDSA signature of `message` under the signing key `k`.
-    The hashing algorithm is SHA256.
+    Build an ECDSA signing key from its secret `exponent` and the affine coordinates of its known `public_point`.
+    Unlike `ecdsa.SigningKey.from_secret_exponent`, this skips the scalar multiplication of the public key.
+    """
+    point = ecdsa.ellipticcurve.PointJacobi(curve.curve, *public_point, 1, curve.order)
+    k = ecdsa.SigningKey(_error__please_use_generate=True)  # Mirrors `ecdsa.SigningKey.from_secret_exponent`.
+    k.curve, k.default_hashfunc, k.baselen = curve, hashlib.sha1, curve.baselen
+    k.verifying_key = ecdsa.VerifyingKey.from_public_point(point, curve, hashlib.sha1, validate_point=False)
+    k.privkey = ecdsa.ecdsa.Private_key(k.verifying_key.pubkey, exponent)
+    k.privkey.order = curve.order
+    return k
+
+
+def ecdsa_sign(k: ecdsa.SigningKey, message: bytes, backend: typing.Optional['ec.Backend'] = None) -> bytes:
+    """
+    Generate an ECDSA signature of `message` under the signing key `k`, through the EC `backend` if provided.
+    The hashing algorithm is SHA256 and the nonce is deterministic (RFC 6979).
     Outputs the strict DER canonical encoding of the signature (BIP66).
     """
-    return k.sign(message, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der_canonize)
+    if backend is None:
+        return k.sign_deterministic(message, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der_canonize)
+
+    assert backend.curve == k.curve
+    return backend.sign(k.privkey.secret_multiplier, message)
+
+
+def ecdsa_sign_batch(k: ecdsa.SigningKey, messages: typing.Sequence[bytes],
+                     backend: typing.Optional['ec.Backend'] = None) -> typing.List[bytes]:
+    """Like `ecdsa_sign`, for each of the `messages`: a `backend` loads the signing key once for the whole batch."""
+    if backend is None:
+        return [ecdsa_sign(k, message) for message in messages]
+
+    assert backend.curve == k.curve
+    return backend.sign_batch(k.privkey.secret_multiplier, messages)
@@ -3,23 +3,103 @@
 
 """A Deterministic Hierarchical Key Assignment Scheme."""
 
+import collections
+import concurrent.futures
+import copy
+import enum
+import functools
 import typing
 
-from . import hierarchy, crypto, encode
+from . import hierarchy, crypto, encode, cache, compact, checkpoints
 from .constants import CryptoConstants as cc
 
 __author__ = 'aldur'
 
+_SUBTREES_PER_WORKER = 4  # Split the hierarchy in more subtrees than workers, so that the load stays balanced.
+_UNLOCK_CHUNK_SIZE = 64  # The number of edges that a thread of `unlock` decrypts at once.
+
+
+class Retention(enum.Enum):
+    """
+    Which key material the nodes retain after `keygen`:
+    1. `FULL`: every node keeps its label, secret, encryption key, and private key.
+    2. `KEYS`: nodes drop their label and secret as soon as their children are derived (and cannot be extended).
+    3. `SIGNING`: nodes also drop their encryption key as soon as their children are derived and, within Arcula, their
+    private key as soon as their signing key is assigned: only the signing key and the certificate remain.
+    """
+    FULL = 'full'
+    KEYS = 'keys'
+    SIGNING = 'signing'
+
+
+class EdgeEncryption(enum.Enum):
+    """
+    When `keygen` encrypts the edges of the hierarchy:
+    1. `EAGER`: as soon as the children of each node are derived.
+    2. `LAZY`: on the first access to the `encrypted_edges` of each node (that should retain its encryption key, and
+    whose children should retain their keys).
+    3. `SKIP`: never, for deployments that do not need delegated derivation (`derive_from_edges` and `unlock`).
+    """
+    EAGER = 'eager'
+    LAZY = 'lazy'
+    SKIP = 'skip'
+
+
+class DerivedNode(typing.NamedTuple):
+    """
+    The key material of a node, as output by `DHKA.iter_keygen`.
+    Nodes are numbered by their breadth-first `index`; `parent` is the index of the parent node (`None` for the root).
+    """
+    index: int
+    parent: typing.Optional[int]
+    id: int
+    label: bytes
+    secret: bytes
+    encryption_key: bytes
+    key: bytes
+    encrypted_edges: typing.List[typing.Tuple[bytes, bytes]]
+
+
+_worker_scheme: typing.Optional['DHKA'] = None  # The key assignment scheme of a `keygen` worker process.
+
+
+def _init_keygen_worker(scheme: 'DHKA'):
+    """Initialize a `keygen` worker process with the key assignment scheme it should run."""
+    global _worker_scheme
+    _worker_scheme = scheme
+
+
+def _keygen_subtree_worker(tree_shape: typing.Sequence[typing.Tuple[int, int]],
+                           root_keys: typing.Tuple[bytes, bytes, bytes, bytes]) -> typing.List[tuple]:
+    """
+    Run the key derivation of a subtree with the given `tree_shape` whose root has already been assigned `root_keys`.
+    Return the state of each node of the subtree, in breadth-first order.
+    """
+    scheme = _worker_scheme
+    nodes = hierarchy.from_shape(tree_shape, cls=type(scheme.root))
+    nodes[0]._label, nodes[0]._secret, nodes[0]._encryption_key, nodes[0]._key = root_keys
+
+    scheme._keygen_subtree(nodes[0])
+    return [scheme._node_state(u) for u in nodes]
+
 
 class DHKA(hierarchy.Hierarchy):
     """
     A deterministic hierarchical key assignment scheme.
 
-    Takes a `root` node encoding the hierarchy.
+    Takes a `root` node encoding the hierarchy (possibly, the root of a `compact.CompactHierarchy`).
     `prf_f`, `enc_f`, `dec_f` are respectively:
     1. A PRF function that outputs 256 bits.
     2/3. A symmetric encryption and decryption function.
     Please refer to their type hinting for their signatures.
+    `prf_batch_f` optionally evaluates `prf_f` under a single key for a sequence of messages (by default, through
+    `crypto.prf_batch`).
+    `cache_size` bounds the number of nodes kept by the on-demand derivation of `derive`, and the number of edges kept
+    by the delegated derivation of `derive_from_edges`.
+    `retention` selects the key material that the nodes retain after `keygen` (see `Retention`).
+    `edge_encryption` selects when the edges are encrypted (see `EdgeEncryption`).
+    `checkpoints` optionally stores the secrets met by `derive` at regular depths, so that the derivation of deep
+    nodes resumes from them.
     """
 
     def __init__(
@@ -27,26 +107,86 @@ class DHKA(hierarchy.Hierarchy):
             prf_f: typing.Callable[[bytes, bytes], bytes] = crypto.sha3_512_half_k,
             enc_f: typing.Callable[[bytes, bytes], typing.Tuple[bytes, bytes]] = crypto.aes_ae,
             dec_f: typing.Callable[[bytes, typing.Tuple[bytes, bytes]], bytes] = crypto.aes_ad,
+            cache_size: int = 1024,
+            prf_batch_f: typing.Optional[typing.Callable[[bytes, typing.Sequence[bytes]], typing.List[bytes]]] = None,
+            retention: Retention = Retention.FULL,
+            edge_encryption: EdgeEncryption = EdgeEncryption.EAGER,
+            checkpoints: typing.Optional['checkpoints.CheckpointStore'] = None,
     ):
         super().__init__(root)
+        assert edge_encryption is not EdgeEncryption.LAZY or retention is not Retention.SIGNING, \
+            'Lazy edges are encrypted under the keys that the nodes retain.'
+        self.retention = retention
+        self.edge_encryption = edge_encryption
+        self.checkpoints = checkpoints
 
         self.prf_f = prf_f  # A PRF that outputs 256 bits
+        self.prf_batch_f = prf_batch_f or functools.partial(crypto.prf_batch, prf_f)  # The same PRF, in batches
         self.enc_f = enc_f
         self.dec_f = dec_f
 
+        self._derivation_fingerprint: typing.Optional[bytes] = None  # The seed the derivation cache refers to
+        self._derivation_cache = cache.LRUCache(cache_size)  # Maps paths to their derived node
+        self._edge_cache = cache.LRUCache(cache_size)  # Maps edges to their decryption
+
+    def _labels_secrets_encryption_keys_from_parent(self, parent_secret: bytes, identifiers: typing.Sequence[int]) \
+            -> typing.List[typing.Tuple[bytes, bytes, bytes, bytes]]:
+        """
+        Generate the label, secret, encryption key, and private key for each of a set of siblings, starting from the
+        parent's secret.
+        """
+        labels = [encode.int_to_bytes_8(identifier) for identifier in identifiers]
+        secrets = self.prf_batch_f(parent_secret, [cc.PRF_SECRET_PREFIX.value + label for label in labels])
+
+        return [
+            (
+                label, secret,
+                self.prf_f(secret, cc.PRF_ENCRYPTION_PREFIX.value + label),
+                self.prf_f(secret, cc.PRF_PRIVATE_KEY_PREFIX.value + label)
+            ) for label, secret in zip(labels, secrets)
+        ]
+
     def _label_secret_encryption_key_from_parent(self, parent_secret: bytes, identifier: int) \
             -> typing.Tuple[bytes, bytes, bytes, bytes]:
         """Generate the label, secret, encryption key, and private key for a node, starting from the parent's secret."""
-        label = encode.int_to_bytes_8(identifier)
-        secret = self.prf_f(parent_secret, cc.PRF_SECRET_PREFIX.value + label)
-        encryption_key = self.prf_f(secret, cc.PRF_ENCRYPTION_PREFIX.value + label)
-        private_key = self.prf_f(secret, cc.PRF_PRIVATE_KEY_PREFIX.value + label)
+        return self._labels_secrets_encryption_keys_from_parent(parent_secret, [identifier])[0]
+
+    def _secret_from_path(self, secret: bytes, identifiers: typing.Iterable[int]) -> bytes:
+        """Follow the `identifiers` starting from a node's `secret` and return the secret of the node they lead to."""
+        for identifier in identifiers:
+            secret = self.prf_f(secret, cc.PRF_SECRET_PREFIX.value + encode.int_to_bytes_8(identifier))
+        return secret
 
-        return label, secret, encryption_key, private_key
+    def _secret_from_checkpoints(self, seed: bytes, identifiers: typing.Sequence[int]) -> bytes:
+        """
+        Like `_secret_from_path` from the `seed`, but resume from the deepest checkpoint along the path and store the
+        checkpoints that are met.
+        """
+        store = self.checkpoints
+        store.bind(seed)
+        keys = store.keys(identifiers)
+
+        depth, secret = 0, seed
+        for i in range(len(keys) - 1, -1, -1):
+            checkpoint = store.get(keys[i])
+            if checkpoint is not None:
+                depth, secret = (i + 1) * store.interval, checkpoint
+                break
+
+        for depth in range(depth + 1, len(identifiers) + 1):
+            secret = self._secret_from_path(secret, identifiers[depth - 1:depth])
+            if depth % store.interval == 0:
+                store[keys[depth // store.interval - 1]] = secret
+        return secret
+
+    def _edge_encryption_keys(self, parent_encryption_key: bytes, child_labels: typing.Sequence[bytes]) \
+            -> typing.List[bytes]:
+        """Generate the encryption keys for the edges that reach a set of siblings."""
+        return self.prf_batch_f(parent_encryption_key, [cc.PRF_EDGE_PREFIX.value + label for label in child_labels])
 
     def _edge_encryption_key(self, parent_encryption_key: bytes, child_label: bytes) -> bytes:
         """Generate the encryption key for an edge."""
-        return self.prf_f(parent_encryption_key, cc.PRF_EDGE_PREFIX.value + child_label)
+        return self._edge_encryption_keys(parent_encryption_key, [child_label])[0]
 
     def _encrypt_edge(self, edge_encryption_key: bytes, message: bytes) -> typing.Tuple[bytes, bytes]:
         """
@@ -54,30 +194,374 @@ class DHKA(hierarchy.Hierarchy):
         """
         return self.enc_f(edge_encryption_key, message)
 
-    def keygen(self, seed: bytes):
-        """Generate a private/public key pair for each node of the tree."""
+    def _decrypt_edge(self, edge_encryption_key: bytes, cipher: typing.Tuple[bytes, bytes]) -> bytes:
+        """Decrypt the `cipher` associated with an edge to the (`child_encryption_key`, `child_private_key`) pair."""
+        return self.dec_f(edge_encryption_key, cipher)
+
+    def keygen(self, seed: bytes, workers: int = 1):
+        """
+        Generate a private/public key pair for each node of the tree.
+        When `workers` is greater than one, independent subtrees are derived in parallel by as many processes.
+        """
+        assert workers > 0
+        assert workers == 1 or not isinstance(self.root, compact.Node), 'Compact hierarchies are derived sequentially.'
+        self._derive_root(seed)
+
+        if workers > 1:
+            self._keygen_parallel(workers)
+        else:
+            self._keygen_subtree(self.root)
+
+    def _derive_root(self, seed: bytes):
+        """Derive the root of the hierarchy from the `seed`."""
         root = self.root
         root._label, root._secret, root._encryption_key, root._key = \
             self._label_secret_encryption_key_from_parent(seed, root.id)
 
-        q = [root]
+    def _derive_children(self, u: hierarchy.DHKANode, start: int = 0):
+        """
+        Derive the children `u.edges[start:]` of the already derived node `u`, and encrypt the related edges (or defer
+        their encryption) as selected by `edge_encryption`.
+        """
+        assert len(set(e.id for e in u.edges)) == len(u.edges)
+        children = u.edges[start:]
+        encrypt = self.edge_encryption is EdgeEncryption.EAGER
+        for v, (derived, edge_encryption) in zip(
+                children, self._derive_siblings(u._secret, u._encryption_key, [v.id for v in children], encrypt)
+        ):
+            v._label, v._secret, v._encryption_key, v._key = derived
+            if encrypt:
+                u.encrypted_edges.append(edge_encryption)
+
+        if encrypt:
+            assert len(u.encrypted_edges) == len(u.edges)
+        elif self.edge_encryption is EdgeEncryption.LAZY and children:
+            u._edge_encrypter = self._encrypt_edges
+
+    def _encrypt_edges(self, u: hierarchy.DHKANode, start: int = 0) -> typing.List[typing.Tuple[bytes, bytes]]:
+        """Encrypt the edges that reach the already derived children `u.edges[start:]` of `u`."""
+        children = u.edges[start:]
+        assert u._encryption_key is not None and all(v._key is not None for v in children), \
+            'The keys of the edge have not been retained.'
+        edge_encryption_keys = self._edge_encryption_keys(
+            u._encryption_key, [encode.int_to_bytes_8(v.id) for v in children]
+        )
+        return [
+            self._encrypt_edge(edge_encryption_key, v._encryption_key + v._key)
+            for v, edge_encryption_key in zip(children, edge_encryption_keys)
+        ]
+
+    def _release(self, u: hierarchy.DHKANode):
+        """Drop the key material of `u`, whose children have all been derived, that the `retention` does not keep."""
+        if self.retention is Retention.FULL:
+            return
+        u._label, u._secret = None, None
+        if self.retention is Retention.SIGNING:
+            u._encryption_key = None
+
+    def _derive_siblings(
+            self, parent_secret: bytes, parent_encryption_key: bytes, identifiers: typing.Sequence[int],
+            encrypt: bool = True
+    ) -> typing.List[
+        typing.Tuple[typing.Tuple[bytes, bytes, bytes, bytes], typing.Optional[typing.Tuple[bytes, bytes]]]
+    ]:
+        """
+        Generate the label, secret, encryption key, and private key of each of a set of siblings, together with the
+        encryption of the edge that reaches it from the parent (`None` unless `encrypt`).
+        The PRF is evaluated in batches, once for all the siblings.
+        """
+        if not identifiers:
+            return []
+
+        derived = self._labels_secrets_encryption_keys_from_parent(parent_secret, identifiers)
+        if not encrypt:
+            return [(d, None) for d in derived]
+
+        edge_encryption_keys = self._edge_encryption_keys(parent_encryption_key, [d[0] for d in derived])
+
+        return [
+            (d, self._encrypt_edge(edge_encryption_key, d[2] + d[3]))
+            for d, edge_encryption_key in zip(derived, edge_encryption_keys)
+        ]
+
+    def _iter_keygen_subtree(self, root: hierarchy.DHKANode, start: int = 0) -> typing.Iterator[hierarchy.DHKANode]:
+        """
+        Derive the keys of the descendants of the already derived `root`, starting from its `start`-th child.
+        Yield each descendant as soon as it has been derived.
+        """
+        if isinstance(root, compact.Node):
+            yield from self._iter_keygen_compact(root, start)
+            return
+
+        q = collections.deque([(root, start)])
         visited = set()
 
         while q:
-            u = q.pop(0)
+            u, start = q.popleft()
             visited.add(u)
 
-            for i, v in enumerate(u.edges):
+            for v in u.edges[start:]:
                 if v in visited:
                     assert False, 'The poset is not a tree.'
-                q.append(v)
+                q.append((v, 0))
+
+            self._derive_children(u, start)
+            self._release(u)
+            yield from u.edges[start:]
 
-                v._label, v._secret, v._encryption_key, v._key = \
-                    self._label_secret_encryption_key_from_parent(u._secret, v.id)
+    def _iter_keygen_compact(self, root: compact.Node, start: int = 0) -> typing.Iterator[compact.Node]:
+        """
+        Derive the keys of the descendants of the already derived root of a compact hierarchy, directly within its
+        buffers; as its nodes are numbered in breadth-first order, no queue is needed.
+        Yield a view of each descendant as soon as it has been derived.
+        """
+        tree = root.hierarchy
+        assert root.index == 0 and start == 0, 'Compact hierarchies are derived from their root.'
+        secrets, encryption_keys, keys = tree.secrets, tree.encryption_keys, tree.keys
+        width = tree.key_material.slot_size
+        blank = bytes(width)
+        encrypt = self.edge_encryption is EdgeEncryption.EAGER
+        if self.edge_encryption is EdgeEncryption.LAZY:
+            tree.edge_encrypter = self._encrypt_edges
 
-                edge_encryption_key = self._edge_encryption_key(u._encryption_key, v._label)
-                edge_encryption = self._encrypt_edge(edge_encryption_key, v._encryption_key + v._key)
+        for i in range(len(tree)):
+            children = tree.children(i)
+            identifiers = [tree.ids[j] for j in children]
+            assert len(set(identifiers)) == len(identifiers)
+            for j, ((_, secret, encryption_key, key), edge_encryption) in zip(children, self._derive_siblings(
+                    bytes(secrets[i * width:(i + 1) * width]), bytes(encryption_keys[i * width:(i + 1) * width]),
+                    identifiers, encrypt
+            )):
+                secrets[j * width:(j + 1) * width] = secret  # Write directly within the key arena.
+                encryption_keys[j * width:(j + 1) * width] = encryption_key
+                keys[j * width:(j + 1) * width] = key
+                if encrypt:
+                    tree.set_edge(j, edge_encryption)
+                yield tree.node(j)
 
-                u.encrypted_edges.append(edge_encryption)
+            if self.retention is not Retention.FULL:  # Labels are not stored.
+                secrets[i * width:(i + 1) * width] = blank
+                if self.retention is Retention.SIGNING:
+                    encryption_keys[i * width:(i + 1) * width] = blank
 
-            assert len(u.encrypted_edges) == len(u.edges)
+    def iter_keygen(self, seed: bytes) -> typing.Iterator[DerivedNode]:
+        """
+        Generate a private/public key pair for each node of the tree, without assigning them to the nodes.
+
+        Yield the key material of each node, in breadth-first order, as soon as the edges to its children have been
+        encrypted.
+        The memory required is bounded by the width of the tree, so that the output can be streamed elsewhere.
+        The edges are encrypted unless `edge_encryption` skips them.
+        """
+        root = self.root
+        encrypt = self.edge_encryption is not EdgeEncryption.SKIP
+        q = collections.deque([
+            (0, None, root, self._label_secret_encryption_key_from_parent(seed, root.id))
+        ])
+        n_nodes = 1
+
+        while q:
+            index, parent, u, (label, secret, encryption_key, key) = q.popleft()
+            assert len(set(e.id for e in u.edges)) == len(u.edges)
+
+            encrypted_edges = []
+            for v, (derived, edge_encryption) in zip(
+                    u.edges, self._derive_siblings(secret, encryption_key, [v.id for v in u.edges], encrypt)
+            ):
+                if encrypt:
+                    encrypted_edges.append(edge_encryption)
+
+                q.append((n_nodes, index, v, derived))
+                n_nodes += 1
+
+            yield DerivedNode(index, parent, u.id, label, secret, encryption_key, key, encrypted_edges)
+
+    def _keygen_subtree(self, root: hierarchy.DHKANode, start: int = 0):
+        """Derive the keys of the descendants of the already derived `root`, starting from its `start`-th child."""
+        for _ in self._iter_keygen_subtree(root, start):
+            pass
+
+    def _node_state(self, u: hierarchy.DHKANode) -> tuple:
+        """Return the state assigned by `keygen` to node `u`, in a form that can be pickled."""
+        return u._label, u._secret, u._encryption_key, u._key, u._encrypted_edges  # Lazy edges stay deferred.
+
+    def _set_node_state(self, u: hierarchy.DHKANode, state: tuple):
+        """Assign to node `u` a `state` returned by `_node_state`."""
+        u._label, u._secret, u._encryption_key, u._key, u.encrypted_edges = state
+        if self.edge_encryption is EdgeEncryption.LAZY and u.edges:
+            u._edge_encrypter = self._encrypt_edges
+
+    def _worker_copy(self) -> 'DHKA':
+        """Return a copy of this scheme to ship to the worker processes, without the hierarchy and the caches."""
+        scheme = copy.copy(self)
+        scheme.root = (hierarchy.Node if isinstance(self.root, compact.Node) else type(self.root))(self.root.id)
+        scheme._derivation_fingerprint, scheme._derivation_cache = None, cache.LRUCache(self._derivation_cache.maxsize)
+        scheme._edge_cache = cache.LRUCache(self._edge_cache.maxsize)
+        scheme.checkpoints = None
+        return scheme
+
+    def _keygen_parallel(self, workers: int):
+        """
+        Derive the hierarchy below the already derived root in `workers` processes.
+
+        First, derive the top levels of the hierarchy until there are enough independent subtrees (or until the
+        hierarchy stops growing wider, as it happens with chains).
+        Then, derive each subtree in a worker process and merge their results back into the nodes.
+        """
+        frontier = [self.root]
+        while len(frontier) < _SUBTREES_PER_WORKER * workers:
+            children = [v for u in frontier for v in u.edges]
+            if not children or (len(frontier) > 1 and len(children) <= len(frontier)):
+                break
+            for u in frontier:
+                self._derive_children(u)
+                self._release(u)
+            frontier = children
+
+        scheme = self._worker_copy()
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_keygen_worker, initargs=(scheme, )
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _keygen_subtree_worker, hierarchy.shape(u), (u._label, u._secret, u._encryption_key, u._key)
+                ) for u in frontier
+            ]
+            for u, future in zip(frontier, futures):
+                for v, state in zip(hierarchy.breadth_first(u), future.result()):
+                    self._set_node_state(v, state)
+
+    def extend(self, parent: hierarchy.DHKANode, children: typing.Sequence[hierarchy.DHKANode]):
+        """
+        Attach the `children` (and their descendants) to the already derived `parent` node.
+        Only the keys of the new nodes are derived, and their edges appended to the `encrypted_edges` of the `parent`.
+        """
+        assert parent._secret is not None, 'The parent node has not been derived yet, or its secret was not retained.'
+        assert not isinstance(parent, compact.Node), 'Compact hierarchies cannot be extended.'
+        assert len(set(v.id for v in parent.edges + list(children))) == len(parent.edges) + len(children)
+
+        start = len(parent.edges)
+        parent.edges.extend(children)
+        self._keygen_subtree(parent, start)
+
+    def detach(self, parent: hierarchy.DHKANode, child: hierarchy.DHKANode):
+        """
+        Detach the `child` (and its descendants) from the `parent` node, together with the encrypted edge that reaches
+        it; the keys of the other nodes are not affected.
+        """
+        assert not isinstance(parent, compact.Node), 'Compact hierarchies cannot be modified.'
+        i = parent.edges.index(child)
+        del parent.edges[i]
+        if i < len(parent._encrypted_edges):  # Deferred edges are not encrypted yet.
+            del parent._encrypted_edges[i]
+
+    def truncate(self, parent: hierarchy.DHKANode, count: int):
+        """
+        Detach every child of the `parent` node but the first `count` ones (and their descendants), together with the
+        encrypted edges that reach them, in a single step.
+        """
+        assert not isinstance(parent, compact.Node), 'Compact hierarchies cannot be modified.'
+        assert 0 <= count <= len(parent.edges)
+        del parent.edges[count:]
+        del parent._encrypted_edges[count:]  # Deferred edges are not encrypted yet.
+
+    def derive(self, seed: bytes, path: typing.Sequence[int]) -> typing.Tuple[bytes, bytes, bytes, bytes]:
+        """
+        Derive the label, secret, encryption key, and private key of a single node, without a full `keygen`.
+
+        The `path` lists the identifiers of the nodes from the root (included) to the target node.
+        Only the secrets along the path are computed, so that the cost depends on the depth of the node (or on its
+        distance from the deepest checkpoint along the path, see `checkpoints`).
+        Derived nodes are kept in a bounded LRU cache, that is reset whenever the `seed` changes.
+        """
+        path = tuple(path)
+        assert path, 'The path should at least include the root.'
+
+        fingerprint = crypto.fingerprint(seed)  # The seed itself is not retained.
+        if fingerprint != self._derivation_fingerprint:
+            self._derivation_cache.clear()
+            self._derivation_fingerprint = fingerprint
+
+        derived = self._derivation_cache.get(path)
+        if derived is not None:
+            return derived
+
+        parent = self._derivation_cache.get(path[:-1]) if len(path) > 1 else None
+        if parent is not None:
+            parent_secret = parent[1]
+        elif self.checkpoints is not None:
+            parent_secret = self._secret_from_checkpoints(seed, path[:-1])
+        else:
+            parent_secret = self._secret_from_path(seed, path[:-1])
+
+        derived = self._label_secret_encryption_key_from_parent(parent_secret, path[-1])
+        self._derivation_cache[path] = derived
+        return derived
+
+    def derive_from_edges(self, ancestor: hierarchy.DHKANode, encryption_key: bytes, path: typing.Sequence[int]) \
+            -> typing.Tuple[bytes, bytes]:
+        """
+        Derive the encryption key and the private key of a descendant of the `ancestor` node, starting from the
+        `encryption_key` of the `ancestor` and the public `encrypted_edges` of the hierarchy.
+        This does not require the seed.
+
+        The `path` lists the identifiers of the nodes from the `ancestor` (excluded) to the target node.
+        Decrypted edges are kept in a bounded LRU cache, so that lookups under a common prefix skip the decryption.
+        """
+        assert path, 'The path should at least include a descendant.'
+
+        u, key = ancestor, None
+        for identifier in path:
+            cache_key = encryption_key, identifier
+            decrypted = self._edge_cache.get(cache_key)
+            if decrypted is not None and (decrypted[0] >= len(u.edges) or u.edges[decrypted[0]].id != identifier):
+                decrypted = None  # The children of `u` have been detached since.
+            if decrypted is None:
+                i = next((i for i, v in enumerate(u.edges) if v.id == identifier), None)
+                assert i is not None, f'Could not find node {identifier} among the children of {u}.'
+
+                edge_encryption_key = self._edge_encryption_key(encryption_key, encode.int_to_bytes_8(identifier))
+                decrypted = i, self._decrypt_edge(edge_encryption_key, u.encrypted_edges[i])
+                self._edge_cache[cache_key] = decrypted
+
+            i, message = decrypted
+            u, encryption_key, key = u.edges[i], message[:256 // 8], message[256 // 8:]
+
+        return encryption_key, key
+
+    def _decrypt_edges(self, edges: typing.Sequence[typing.Tuple[bytes, bytes, typing.Tuple[bytes, bytes]]]) \
+            -> typing.List[bytes]:
+        """Decrypt a sequence of edges, each given as (`parent_encryption_key`, `child_label`, `cipher`)."""
+        return [self._decrypt_edge(self._edge_encryption_key(k, label), cipher) for k, label, cipher in edges]
+
+    def unlock(self, ancestor: hierarchy.DHKANode, encryption_key: bytes, workers: typing.Optional[int] = None):
+        """
+        Starting from the `encryption_key` of the `ancestor` node, decrypt the public `encrypted_edges` of its whole
+        subtree and assign the `_encryption_key` and the `_key` of every descendant.
+        This does not require the seed.
+
+        The subtree is decrypted level by level, and each level is split among a pool of `workers` threads
+        (the AES-GCM decryption releases the GIL).
+        """
+        ancestor._encryption_key = encryption_key
+
+        level = [ancestor]
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            while level:
+                for u in level:
+                    assert len(u.encrypted_edges) == len(u.edges)
+                children = [v for u in level for v in u.edges]
+                edges = [
+                    (u._encryption_key, encode.int_to_bytes_8(v.id), cipher)
+                    for u in level for v, cipher in zip(u.edges, u.encrypted_edges)
+                ]
+
+                if len(edges) > _UNLOCK_CHUNK_SIZE:
+                    chunks = [edges[i:i + _UNLOCK_CHUNK_SIZE] for i in range(0, len(edges), _UNLOCK_CHUNK_SIZE)]
+                    messages = [m for chunk in executor.map(self._decrypt_edges, chunks) for m in chunk]
+                else:  # Not worth the overhead of the thread pool, as it happens along chains.
+                    messages = self._decrypt_edges(edges)
+
+                for v, message in zip(children, messages):
+                    v._encryption_key, v._key = message[:256 // 8], message[256 // 8:]
+                level = children
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Pluggable backends for the elliptic curve operations of ECDSA."""
+
+import hashlib
+import typing
+
+import ecdsa
+
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec as openssl_ec, utils as openssl_utils
+
+from . import cache, crypto, fixedbase
+
+__author__ = 'aldur'
+
+Point = typing.Tuple[int, int]  # The affine coordinates of a point on the curve.
+
+
+class Backend:
+    """
+    Compute public keys, signatures, and signature verifications over an ECDSA `curve`.
+    Signatures are deterministic (RFC 6979), hash their message with SHA256, and are encoded in the strict DER
+    canonical format of BIP66: every backend outputs the same signature for the same key and message.
+    """
+
+    def __init__(self, curve: ecdsa.curves.Curve):
+        self.curve = curve
+
+    def precompute(self, public_point: Point):
+        """Prepare for the verification of many signatures under `public_point`; does nothing by default."""
+
+    def public_point(self, exponent: int) -> Point:
+        """Return the public point corresponding to the secret `exponent`."""
+        raise NotImplementedError
+
+    def public_points(self, exponents: typing.Sequence[int]) -> typing.List[Point]:
+        """Return the public points corresponding to many secret `exponents`."""
+        return [self.public_point(exponent) for exponent in exponents]
+
+    def sign(self, exponent: int, message: bytes) -> bytes:
+        """Sign `message` with the secret `exponent`."""
+        raise NotImplementedError
+
+    def sign_batch(self, exponent: int, messages: typing.Sequence[bytes]) -> typing.List[bytes]:
+        """Sign each of the `messages` with the secret `exponent`."""
+        return [self.sign(exponent, message) for message in messages]
+
+    def verify(self, public_point: Point, signature: bytes, message: bytes) -> bool:
+        """Return whether `signature` is a valid signature of `message` under `public_point`."""
+        raise NotImplementedError
+
+
+class EcdsaBackend(Backend):
+    """
+    A backend built on the pure-Python `ecdsa` package; supports any curve.
+    Private keys are loaded once for each call of `sign_batch` and are not retained afterwards, so that repeated
+    signatures under the same key (e.g. the cold storage key) should be issued in batches.
+    """
+
+    def _load_private_key(self, exponent: int):
+        return ecdsa.SigningKey.from_secret_exponent(exponent, self.curve)
+
+    def _sign_loaded(self, k, message: bytes) -> bytes:
+        """Sign `message` with the private key `k` returned by `_load_private_key`."""
+        return k.sign_deterministic(message, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der_canonize)
+
+    def public_point(self, exponent: int) -> Point:
+        point = (self.curve.generator * exponent).to_affine()
+        return point.x(), point.y()
+
+    def sign(self, exponent: int, message: bytes) -> bytes:
+        return self.sign_batch(exponent, [message])[0]
+
+    def sign_batch(self, exponent: int, messages: typing.Sequence[bytes]) -> typing.List[bytes]:
+        k = self._load_private_key(exponent)
+        return [self._sign_loaded(k, message) for message in messages]
+
+    def verify(self, public_point: Point, signature: bytes, message: bytes) -> bool:
+        point = ecdsa.ellipticcurve.PointJacobi(self.curve.curve, *public_point, 1, self.curve.order)
+        pk = ecdsa.VerifyingKey.from_public_point(point, self.curve, validate_point=False)
+        try:
+            return pk.verify(signature, message, hashfunc=hashlib.sha256, sigdecode=ecdsa.util.sigdecode_der)
+        except ecdsa.BadSignatureError:
+            return False
+
+
+class OpenSSLBackend(EcdsaBackend):
+    """
+    A backend that signs and verifies through the OpenSSL bindings of the `cryptography` package; supports secp256k1.
+
+    Public points are still computed by `ecdsa`: OpenSSL has no precomputed tables for the generator of secp256k1,
+    and its scalar multiplication is slower than the precomputed one of `ecdsa`.
+    """
+
+    _CURVES = {ecdsa.SECP256k1.name: openssl_ec.SECP256K1}
+
+    def __init__(self, curve: ecdsa.curves.Curve):
+        super().__init__(curve)
+        if curve.name not in self._CURVES:
+            raise UnsupportedAlgorithm(f'Curve {curve.name} is not supported.')
+        self._openssl_curve = self._CURVES[curve.name]()
+        openssl_ec.derive_private_key(1, self._openssl_curve)  # Raises if the OpenSSL build lacks the curve.
+
+        try:  # Raises if the OpenSSL build lacks RFC 6979.
+            self._algorithm = openssl_ec.ECDSA(hashes.SHA256(), deterministic_signing=True)
+        except TypeError:  # pragma: no cover
+            raise UnsupportedAlgorithm('Deterministic signatures require `cryptography` 43 or later.')
+
+    def _load_private_key(self, exponent: int) -> openssl_ec.EllipticCurvePrivateKey:
+        return openssl_ec.derive_private_key(exponent, self._openssl_curve)
+
+    def _sign_loaded(self, k: openssl_ec.EllipticCurvePrivateKey, message: bytes) -> bytes:
+        signature = k.sign(message, self._algorithm)
+        r, s = openssl_utils.decode_dss_signature(signature)
+        return ecdsa.util.sigencode_der_canonize(r, s, self.curve.order)
+
+    def verify(self, public_point: Point, signature: bytes, message: bytes) -> bool:
+        pk = openssl_ec.EllipticCurvePublicNumbers(*public_point, self._openssl_curve).public_key()
+        try:
+            pk.verify(signature, message, openssl_ec.ECDSA(hashes.SHA256()))
+        except InvalidSignature:
+            return False
+        return True
+
+
+_generator_tables: typing.Dict[str, fixedbase.Table] = {}  # The generator tables, shared by the backends of a curve.
+
+
+class FixedBaseBackend(EcdsaBackend):
+    """
+    A backend that multiplies the generator, and any point registered through `precompute`, by table lookups.
+    The nonces of the signatures are multiplied by the generator as well.
+
+    When a `directory` is provided, tables are memory-mapped from there and saved there after being computed.
+    """
+
+    def __init__(self, curve: ecdsa.curves.Curve, directory: typing.Optional[str] = None):
+        super().__init__(curve)
+        self.directory = directory
+        self._tables: typing.Dict[Point, fixedbase.Table] = {}
+
+        generator = (curve.generator.x(), curve.generator.y())
+        self._generator_table = _generator_tables.get(curve.name)
+        if self._generator_table is None:
+            self._generator_table = _generator_tables[curve.name] = self.precompute(generator)
+        self._tables[generator] = self._generator_table
+
+    def precompute(self, public_point: Point) -> fixedbase.Table:
+        """Return the table of `public_point`, loading or computing it on first use."""
+        table = self._tables.get(public_point)
+        if table is not None:
+            return table
+
+        path = None
+        if self.directory is not None:
+            name = hashlib.sha256(f'{self.curve.name}:{public_point[0]}:{public_point[1]}'.encode()).hexdigest()
+            path = f'{self.directory}/{name}.table'
+            try:
+                table = fixedbase.Table.load(path, self.curve, public_point)
+            except (FileNotFoundError, ValueError, AssertionError):
+                table = None
+
+        if table is None:
+            table = fixedbase.Table.build(self.curve, public_point)
+            if path is not None:
+                table.save(path)
+
+        self._tables[public_point] = table
+        return table
+
+    def public_point(self, exponent: int) -> Point:
+        return self._generator_table.multiply(exponent)
+
+    def public_points(self, exponents: typing.Sequence[int]) -> typing.List[Point]:
+        """Return the public points corresponding to many secret `exponents`, with a single modular inversion."""
+        qs = [self._generator_table.multiply_jacobian(exponent) for exponent in exponents]
+        assert None not in qs, 'Invalid secret exponent.'
+        return fixedbase.to_affine_batch(self.curve.curve.p(), qs) if qs else []
+
+    def _digest(self, message: bytes) -> typing.Tuple[bytes, int]:
+        digest = hashlib.sha256(message).digest()
+        e = int.from_bytes(digest, 'big')
+        excess = 8 * len(digest) - self.curve.order.bit_length()
+        return digest, e >> excess if excess > 0 else e
+
+    def _load_private_key(self, exponent: int) -> int:
+        return exponent  # Signatures only need the secret exponent.
+
+    def _sign_loaded(self, exponent: int, message: bytes) -> bytes:
+        n = self.curve.order
+        digest, e = self._digest(message)
+
+        retry = 0
+        while True:
+            k = ecdsa.rfc6979.generate_k(n, exponent, hashlib.sha256, digest, retry_gen=retry)
+            r = self._generator_table.multiply(k)[0] % n
+            s = ecdsa.numbertheory.inverse_mod(k, n) * (e + r * exponent) % n
+            if r and s:
+                return ecdsa.util.sigencode_der_canonize(r, s, n)
+            retry += 1  # pragma: no cover
+
+    def verify(self, public_point: Point, signature: bytes, message: bytes) -> bool:
+        table = self._tables.get(public_point)
+        if table is None:
+            return super().verify(public_point, signature, message)
+
+        n = self.curve.order
+        try:
+            r, s = ecdsa.util.sigdecode_der(signature, n)
+        except ecdsa.der.UnexpectedDER:
+            return False
+        if not (0 < r < n and 0 < s < n):
+            return False
+
+        _, e = self._digest(message)
+        w = ecdsa.numbertheory.inverse_mod(s, n)
+        q = fixedbase.add(
+            self.curve.curve, self._generator_table.multiply_jacobian(e * w), table.multiply_jacobian(r * w)
+        )
+        q = fixedbase.to_affine(self.curve.curve.p(), q)
+        return q is not None and q[0] % n == r
+
+
+class SigningKeys:
+    """
+    Build the `ecdsa.SigningKey` of 32 bytes secret scalars on demand, computing their public keys through `backend`.
+    Up to `maxsize` signing keys are kept in an LRU cache.
+    """
+
+    def __init__(self, curve: ecdsa.curves.Curve, backend: Backend, maxsize: int = 1024):
+        assert backend.curve == curve
+        self.curve = curve
+        self.backend = backend
+        self._keys = cache.LRUCache(maxsize)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_keys'] = cache.LRUCache(self._keys.maxsize)  # Do not ship the cached keys.
+        return state
+
+    def get(self, scalar: bytes) -> ecdsa.SigningKey:
+        """Return the signing key of the secret `scalar`."""
+        k = self._keys.get(scalar)
+        if k is None:
+            exponent = int.from_bytes(scalar, 'big')
+            k = crypto.ecdsa_signing_key(exponent, self.backend.public_point(exponent), self.curve)
+            self._keys[scalar] = k
+        return k
+
+    def clear(self):
+        """Forget the cached signing keys."""
+        self._keys.clear()
+
+
+def default_backend(curve: ecdsa.curves.Curve) -> Backend:
+    """Return the fastest backend for `curve`."""
+    return FixedBaseBackend(curve)
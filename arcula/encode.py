@@ -40,4 +40,10 @@ def verification_key_to_bytes_33(pk: 'ecdsa.VerifyingKey') -> bytes:
     https://github.com/bitcoinbook/bitcoinbook/blob/develop/ch04.asciidoc
     """
     pk = pk.pubkey.point
-    return (b'\x02' if pk.y() % 2 == 0 else b'\x03') + int_to_bytes_32(pk.x())
+    return point_to_bytes_33((pk.x(), pk.y()))
+
+
+def point_to_bytes_33(point: typing.Tuple[int, int]) -> bytes:
+    """Serialize the affine coordinates of a public point to its compressed form."""
+    x, y = point
+    return (b'\x02' if y % 2 == 0 else b'\x03') + int_to_bytes_32(x)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fixed-base scalar multiplication through precomputed window tables.
+
+A table holds the affine multiples `j * 256^i * P` of a fixed point `P`, for each of the 8 bits windows `i` of a
+scalar and for each `1 <= j < 256`: multiplying `P` by a scalar is then a handful of table lookups and additions,
+without any doubling.
+Tables can be saved to disk and memory-mapped at startup; a digest of their entries detects corrupted files.
+"""
+
+import hashlib
+import mmap
+import typing
+
+import ecdsa
+
+__author__ = 'aldur'
+
+_WINDOW = 8  # The bits of each window of the scalar.
+_ENTRIES = 2 ** _WINDOW - 1  # The non-zero multiples of each window.
+_MAGIC = b'ARCULA-FB2'
+_DIGEST_SIZE = 256 // 8  # The SHA-256 digest of the entries follows the header.
+
+Point = typing.Tuple[int, int]  # Affine coordinates.
+JacobianPoint = typing.Optional[typing.Tuple[int, int, int]]  # `None` is the point at infinity.
+
+
+class Table:
+    """
+    The window table of the fixed point `point` on `curve`.
+    `data` holds the header, the digest of the entries, and the coordinates of the multiples; it can be any buffer
+    (e.g. a memory-mapped file).
+    """
+
+    def __init__(self, curve: ecdsa.curves.Curve, point: Point, data: typing.Union[bytes, mmap.mmap]):
+        self.curve = curve
+        self.point = point
+
+        self._p = curve.curve.p()
+        self._size = (self._p.bit_length() + 7) // 8  # The bytes of each coordinate.
+        self._windows = (curve.order.bit_length() + _WINDOW - 1) // _WINDOW
+
+        assert len(data) == len(self._header()) + _DIGEST_SIZE + self._windows * _ENTRIES * 2 * self._size, \
+            'Invalid table size.'
+        assert data[:len(self._header())] == self._header(), 'The table does not match the point.'
+        self._data = data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = bytes(self._data)  # Memory maps cannot be pickled.
+        return state
+
+    def _header(self) -> bytes:
+        return _MAGIC + b''.join(c.to_bytes(self._size, 'big') for c in self.point)
+
+    @classmethod
+    def build(cls, curve: ecdsa.curves.Curve, point: Point) -> 'Table':
+        """Compute the table of `point` on `curve`."""
+        p = curve.curve.p()
+        size = (p.bit_length() + 7) // 8
+        windows = (curve.order.bit_length() + _WINDOW - 1) // _WINDOW
+
+        entries = bytearray()
+        base = point
+        for _ in range(windows):
+            multiples = [(base[0], base[1], 1)]
+            for _ in range(_ENTRIES):  # The last one is the base of the next window.
+                multiples.append(_add_affine(curve.curve, multiples[-1], base))
+
+            affine = to_affine_batch(p, multiples)
+            for x, y in affine[:_ENTRIES]:
+                entries += x.to_bytes(size, 'big') + y.to_bytes(size, 'big')
+            base = affine[_ENTRIES]
+
+        header = _MAGIC + b''.join(c.to_bytes(size, 'big') for c in point)
+        return cls(curve, point, header + hashlib.sha256(entries).digest() + bytes(entries))
+
+    def verify(self) -> bool:
+        """Check the entries of the table against their digest."""
+        offset = len(self._header())
+        return hashlib.sha256(self._data[offset + _DIGEST_SIZE:]).digest() == self._data[offset:offset + _DIGEST_SIZE]
+
+    def save(self, path: str):
+        """Write the table to `path`."""
+        with open(path, 'wb') as f:
+            f.write(self._data)
+
+    @classmethod
+    def load(cls, path: str, curve: ecdsa.curves.Curve, point: Point) -> 'Table':
+        """Memory-map the table of `point` previously saved at `path`; raise `ValueError` if it is corrupted."""
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        table = cls(curve, point, data)
+        if not table.verify():
+            raise ValueError('The table is corrupted.')
+        return table
+
+    def _entry(self, window: int, j: int) -> Point:
+        offset = len(_MAGIC) + _DIGEST_SIZE + 2 * self._size * (1 + window * _ENTRIES + j - 1)
+        x = int.from_bytes(self._data[offset:offset + self._size], 'big')
+        y = int.from_bytes(self._data[offset + self._size:offset + 2 * self._size], 'big')
+        return x, y
+
+    def multiply_jacobian(self, k: int) -> JacobianPoint:
+        """Return `k * point` in Jacobian coordinates."""
+        k %= self.curve.order
+        result = None
+        window = 0
+        while k:
+            j = k & _ENTRIES
+            if j:
+                result = _add_affine(self.curve.curve, result, self._entry(window, j))
+            k >>= _WINDOW
+            window += 1
+        return result
+
+    def multiply(self, k: int) -> typing.Optional[Point]:
+        """Return `k * point` in affine coordinates (`None` for the point at infinity)."""
+        return to_affine(self._p, self.multiply_jacobian(k))
+
+
+def to_affine(p: int, q: JacobianPoint) -> typing.Optional[Point]:
+    """Convert `q` to affine coordinates modulo `p`."""
+    if q is None:
+        return None
+    x, y, z = q
+    z_inv = ecdsa.numbertheory.inverse_mod(z, p)
+    z_inv_2 = z_inv * z_inv % p
+    return x * z_inv_2 % p, y * z_inv_2 * z_inv % p
+
+
+def to_affine_batch(p: int, qs: typing.Sequence[typing.Tuple[int, int, int]]) -> typing.List[Point]:
+    """Convert the (finite) points `qs` to affine coordinates modulo `p` with one inversion (Montgomery's trick)."""
+    products = []
+    product = 1
+    for _, _, z in qs:
+        product = product * z % p
+        products.append(product)
+
+    inverse = ecdsa.numbertheory.inverse_mod(product, p)
+    affine = [None] * len(qs)
+    for i in range(len(qs) - 1, -1, -1):
+        x, y, z = qs[i]
+        z_inv = inverse * products[i - 1] % p if i else inverse
+        inverse = inverse * z % p
+        z_inv_2 = z_inv * z_inv % p
+        affine[i] = x * z_inv_2 % p, y * z_inv_2 * z_inv % p
+    return affine
+
+
+def _double(curve: ecdsa.ellipticcurve.CurveFp, q: JacobianPoint) -> JacobianPoint:
+    if q is None or q[1] == 0:
+        return None
+    p = curve.p()
+    x, y, z = q
+    y_2 = y * y % p
+    s = 4 * x * y_2 % p
+    m = 3 * x * x
+    if curve.a():
+        z_2 = z * z % p
+        m += curve.a() * z_2 * z_2
+    m %= p
+    x_3 = (m * m - 2 * s) % p
+    return x_3, (m * (s - x_3) - 8 * y_2 * y_2) % p, 2 * y * z % p
+
+
+def _add_affine(curve: ecdsa.ellipticcurve.CurveFp, q: JacobianPoint, r: Point) -> JacobianPoint:
+    """Return `q + r`, where `q` has Jacobian coordinates and `r` is a finite affine point."""
+    if q is None:
+        return r[0], r[1], 1
+
+    p = curve.p()
+    x_1, y_1, z_1 = q
+    z_1_2 = z_1 * z_1 % p
+    h = (r[0] * z_1_2 - x_1) % p
+    t = (r[1] * z_1_2 * z_1 - y_1) % p
+    if not h:
+        return _double(curve, q) if not t else None
+
+    h_2 = h * h % p
+    h_3 = h_2 * h % p
+    v = x_1 * h_2 % p
+    x_3 = (t * t - h_3 - 2 * v) % p
+    return x_3, (t * (v - x_3) - y_1 * h_3) % p, z_1 * h % p
+
+
+def add(curve: ecdsa.ellipticcurve.CurveFp, q: JacobianPoint, r: JacobianPoint) -> JacobianPoint:
+    """Return `q + r`, both in Jacobian coordinates (e.g. as returned by `Table.multiply_jacobian`)."""
+    if r is None:
+        return q
+    return _add_affine(curve, q, to_affine(curve.p(), r))
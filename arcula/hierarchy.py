@@ -5,7 +5,10 @@
 
 import ecdsa
 
+import itertools
 import typing
+if typing.TYPE_CHECKING:
+    from . import ec
 
 __author__ = 'aldur'
 
@@ -41,19 +44,52 @@ class DHKANode(Node):
         self._secret: typing.Optional[bytes] = None
         self._encryption_key: typing.Optional[bytes] = None
 
-        self.encrypted_edges = []  # Holds encrypted public information associated to the edges.
+        self._encrypted_edges = []  # Holds encrypted public information associated to the edges.
+        self._edge_encrypter: typing.Optional[typing.Callable[['DHKANode', int], list]] = None
+
+    @property
+    def encrypted_edges(self) -> list:
+        """The encrypted edges to the children; if they have been deferred, they are encrypted on first access."""
+        if self._edge_encrypter is not None:
+            self._encrypted_edges.extend(self._edge_encrypter(self, len(self._encrypted_edges)))
+            self._edge_encrypter = None
+        return self._encrypted_edges
+
+    @encrypted_edges.setter
+    def encrypted_edges(self, encrypted_edges: list):
+        self._encrypted_edges, self._edge_encrypter = encrypted_edges, None
 
 
 class ArculaNode(DHKANode):
     """
     A node of the Arcula HDW, identified by a numeric `id` and an additional `tag`, that additionally holds:
-    1. A `_signing_key` (pair, secret and public);
+    1. A `_signing_key` (pair, secret and public), stored as its 32 bytes secret scalar and built on demand;
     2. A `certificate` (authorizing the signing key to spend on behalf of this node's identifier `id`).
     """
     def __init__(self, identifier: int, tag: str = None):
         super().__init__(identifier, tag)
-        self.certificate: typing.Optional[bytes] = None
-        self._signing_key: typing.Optional[ecdsa.SigningKey] = None
+        self._certificate: typing.Optional[tuple] = None
+        self._certificate_issuer: typing.Optional[typing.Callable[['ArculaNode'], tuple]] = None
+        self._signing_scalar: typing.Optional[bytes] = None
+        self._signing_keys: typing.Optional['ec.SigningKeys'] = None  # Builds the signing key from its scalar.
+
+    @property
+    def _signing_key(self) -> typing.Optional[ecdsa.SigningKey]:
+        if self._signing_scalar is None:
+            return None
+        return self._signing_keys.get(self._signing_scalar)
+
+    @property
+    def certificate(self) -> typing.Optional[tuple]:
+        """The certificate of the node; if it has been deferred, it is issued on first access and memoized."""
+        if self._certificate is None and self._certificate_issuer is not None:
+            self._certificate = self._certificate_issuer(self)
+            self._certificate_issuer = None
+        return self._certificate
+
+    @certificate.setter
+    def certificate(self, certificate: typing.Optional[tuple]):
+        self._certificate, self._certificate_issuer = certificate, None
 
 
 class Hierarchy:
@@ -66,3 +102,32 @@ class Hierarchy:
     def keygen(self, seed: bytes):
         """Setup the key assignment scheme or the hierarchical deterministic wallet."""
         raise NotImplementedError
+
+
+def breadth_first(root: Node) -> typing.Iterator[Node]:
+    """Iterate over the nodes of the tree rooted at `root` in breadth-first order."""
+    q = [root]
+    visited = set()
+    for u in q:  # `q` grows while we iterate over it.
+        assert u not in visited, 'The poset is not a tree.'
+        visited.add(u)
+        yield u
+        q.extend(u.edges)
+
+
+def shape(root: Node) -> typing.List[typing.Tuple[int, int]]:
+    """
+    Return the shape of the tree rooted at `root`, as the (`id`, number of children) pairs of its nodes in
+    breadth-first order.
+    Unlike the nodes themselves, the shape can be pickled independently of the depth of the tree.
+    """
+    return [(u.id, len(u.edges)) for u in breadth_first(root)]
+
+
+def from_shape(tree_shape: typing.Sequence[typing.Tuple[int, int]], cls=Node) -> typing.List[Node]:
+    """Build the nodes of a tree with the given `tree_shape` and return them in breadth-first order."""
+    nodes = [cls(identifier) for identifier, _ in tree_shape]
+    children = iter(nodes[1:])
+    for u, (_, n_children) in zip(nodes, tree_shape):
+        u.edges = list(itertools.islice(children, n_children))
+    return nodes
@@ -2,15 +2,46 @@
 # -*- coding: utf-8 -*-
 
 import bitcash
+import concurrent.futures
 import ecdsa
 import hashlib
+import itertools
+import typing
 import unittest
+from unittest import mock
 
-from .. import hierarchy, crypto, arcula, encode, bip44
+from cryptography.hazmat.primitives.asymmetric import ec as openssl_ec
+
+from .. import hierarchy, crypto, arcula, encode, bip44, ec, certificates, dhka, compact
 
 __author__ = 'aldur'
 
 
+class CountingBackend(ec.FixedBaseBackend):
+    """A backend that counts the signatures it issues."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.signatures = 0
+
+    def sign_batch(self, exponent: int, messages: typing.Sequence[bytes]) -> typing.List[bytes]:
+        self.signatures += len(messages)
+        return super().sign_batch(exponent, messages)
+
+
+def retains_private_key(backend: ec.Backend, exponent: int) -> bool:
+    """Return whether the secret `exponent`, or any private key, is reachable from the attributes of `backend`."""
+    values = list(vars(backend).values())
+    for value in list(values):
+        value = getattr(value, '_data', value)  # The items of the caches.
+        if isinstance(value, dict):
+            values.extend(itertools.chain(value.keys(), value.values()))
+    return any(
+        isinstance(value, (ecdsa.SigningKey, openssl_ec.EllipticCurvePrivateKey)) or
+        (isinstance(value, int) and value == exponent) for value in values
+    )
+
+
 class ArculaTestCase(unittest.TestCase):
 
     def assert_is_valid_DER_signature_encoding(self, signature: bytes):
@@ -130,6 +161,222 @@ class ArculaTestCase(unittest.TestCase):
                                                                   sigdecode=ecdsa.util.sigdecode_der))
             self.assert_is_valid_DER_signature_encoding(certificate)
 
+    def test_derive_signing_key(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {'BTC': ((1, 2), (0, 1))}
+        root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+
+        wallet = arcula.Arcula(root)
+        wallet.keygen(seed)
+
+        cold_exponent = wallet._cold_storage_keys(seed[256 // 8:]).privkey.secret_multiplier
+        backends = ec.default_backend(wallet.curve), ec.EcdsaBackend(wallet.curve), ec.OpenSSLBackend(wallet.curve)
+        for backend in backends:
+            other_wallet = arcula.Arcula(
+                bip44.bip44_tree(config, cls=hierarchy.ArculaNode), cache_size=2, ec_backend=backend
+            )
+            q = [(root, (root.id, ))]
+            while q:
+                u, path = q.pop()
+                signing_key, (certificate, message) = other_wallet.derive_signing_key(seed, path)
+                self.assertEqual(signing_key.to_der(), u._signing_key.to_der())
+                self.assertEqual(message, u.certificate[1])
+                self.assertTrue(wallet.cold_storage_public_key.verify(certificate, b''.join(message),
+                                                                      hashfunc=hashlib.sha256,
+                                                                      sigdecode=ecdsa.util.sigdecode_der))
+                self.assertIs(other_wallet.derive_signing_key(seed, path)[0], signing_key)
+                q.extend((v, path + (v.id, )) for v in u.edges)
+
+            self.assertEqual(other_wallet.cold_storage_public_key.to_der(), wallet.cold_storage_public_key.to_der())
+            attributes = vars(other_wallet).values()  # Neither the seed nor the cold storage key are retained...
+            self.assertFalse(any(v in (seed, seed[:256 // 8]) for v in attributes if isinstance(v, bytes)))
+            self.assertFalse(any(isinstance(v, ecdsa.SigningKey) for v in attributes))
+            self.assertFalse(retains_private_key(backend, cold_exponent))  # ...not even by the backend.
+
+    def test_audit(self):
+        seed = crypto.sha3_512(b'_secret_seed_audit')
+        root = bip44.bip44_tree({'BTC': ((1, 2), (0, 1))}, cls=hierarchy.ArculaNode)
+
+        wallet = arcula.Arcula(root)
+        wallet.keygen(seed)
+        self.assertTrue(wallet.verify_certificate(root.certificate))
+        self.assertTrue(wallet.audit())
+
+        signature, (public_signing_key, identifier) = root.certificate
+        self.assertFalse(wallet.verify_certificate((signature, (public_signing_key, encode.int_to_bytes_8(1)))))
+        root.edges[0].certificate = root.certificate
+        self.assertFalse(wallet.audit())
+
+    def test_certificate_cache(self):
+        seed = crypto.sha3_512(b'_secret_seed_certificate_cache')
+        config = {'BTC': ((1, 2), (0, 1))}
+        cache = certificates.CertificateCache()
+
+        wallet = bip44.ArculaBIP44(seed, config, certificate_cache=cache)
+        self.assertEqual(len(cache), len(list(hierarchy.breadth_first(wallet.arcula.root))))
+
+        root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+        backend = CountingBackend(ecdsa.SECP256k1)
+        arcula.Arcula(root, ec_backend=backend, certificate_cache=cache).keygen(seed)
+        self.assertEqual(backend.signatures, 0)
+        for u, v in zip(hierarchy.breadth_first(wallet.arcula.root), hierarchy.breadth_first(root)):
+            self.assertEqual(u.certificate, v.certificate)
+
+        # Only the missing certificates are sent to the workers.
+        partial_cache = certificates.CertificateCache()
+        for key in list(cache._data)[1:]:
+            partial_cache[key] = cache.get(key)
+        submit = concurrent.futures.ProcessPoolExecutor.submit
+        for n_submitted in (1, 0):
+            root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+            with mock.patch.object(concurrent.futures.ProcessPoolExecutor, 'submit', autospec=True,
+                                   side_effect=submit) as submitted:
+                arcula.Arcula(root, certificate_cache=partial_cache).keygen(seed, workers=2)
+            self.assertEqual(sum(call.args[1] is arcula._sign_worker for call in submitted.call_args_list), n_submitted)
+            for u, v in zip(hierarchy.breadth_first(wallet.arcula.root), hierarchy.breadth_first(root)):
+                self.assertEqual(u.certificate, v.certificate)
+
+        # Certificates are deterministic, with or without the cache.
+        root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+        arcula.Arcula(root).keygen(seed)
+        for u, v in zip(hierarchy.breadth_first(wallet.arcula.root), hierarchy.breadth_first(root)):
+            self.assertEqual(u.certificate, v.certificate)
+
+    def test_lazy_keygen(self):
+        seed = crypto.sha3_512(b'_secret_seed_lazy_keygen')
+        config = {'BTC': ((1, 2), (0, 1))}
+
+        eager = bip44.ArculaBIP44(seed, config)
+        for workers in (1, 2):
+            backend = CountingBackend(ecdsa.SECP256k1)
+            root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+            wallet = arcula.Arcula(root, ec_backend=backend)
+            wallet.keygen(seed, workers=workers, lazy=True)
+            self.assertEqual(backend.signatures, 0)
+
+            path = "m/44'/BTC/0/xpub/1"
+            lazy_node = bip44.find_bip44_node_with_path(root, path)
+            self.assertEqual(lazy_node.certificate, eager.get_signing_key_certificate(path)[1])
+            self.assertEqual(lazy_node.certificate, eager.get_signing_key_certificate(path)[1])
+            self.assertEqual(backend.signatures, 1)
+
+            wallet.signer.close()
+            self.assertRaises(AssertionError, lambda: root.certificate)
+
+        cold_exponent = wallet._cold_storage_keys(seed[256 // 8:]).privkey.secret_multiplier
+        for backend in (ec.EcdsaBackend(ecdsa.SECP256k1), ec.OpenSSLBackend(ecdsa.SECP256k1)):
+            root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+            wallet = arcula.Arcula(root, ec_backend=backend)
+            wallet.keygen(seed, lazy=True)
+            self.assertEqual(root.certificate, eager.arcula.root.certificate)
+            wallet.signer.close()
+            self.assertFalse(retains_private_key(backend, cold_exponent))  # The backend forgot the key as well.
+
+    def test_signing_key_handles(self):
+        seed = crypto.sha3_512(b'_secret_seed_signing_key_handles')
+        root = bip44.bip44_tree({'BTC': ((1, 2), (0, 1))}, cls=hierarchy.ArculaNode)
+
+        wallet = arcula.Arcula(root, cache_size=2)
+        wallet.keygen(seed)
+        for u in hierarchy.breadth_first(root):
+            self.assertEqual(len(u._signing_scalar), 32)
+            public_key = u._signing_key.get_verifying_key()
+            self.assertEqual(encode.verification_key_to_bytes_33(public_key), u.certificate[1][0])
+        self.assertEqual(len(wallet.signing_keys._keys), 2)
+
+    def test_retention(self):
+        seed = crypto.sha3_512(b'_secret_seed_retention')
+        config = {'BTC': ((1, 2), (0, 1))}
+        eager = bip44.ArculaBIP44(seed, config)
+
+        for workers, lazy in ((1, False), (2, False), (1, True)):
+            root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+            wallet = arcula.Arcula(root, retention=dhka.Retention.SIGNING)
+            wallet.keygen(seed, workers=workers, lazy=lazy)
+
+            for u, v in zip(hierarchy.breadth_first(eager.arcula.root), hierarchy.breadth_first(root)):
+                self.assertEqual((v._label, v._secret, v._encryption_key, v._key), (None, ) * 4)
+                self.assertEqual((v._signing_scalar, v.certificate), (u._signing_scalar, u.certificate))
+            self.assertTrue(wallet.audit())
+
+        tree = compact.CompactHierarchy.from_root(root)
+        wallet = arcula.Arcula(tree.root, retention=dhka.Retention.KEYS)
+        wallet.keygen(seed)
+        self.assertFalse(any(tree.secrets))
+        self.assertTrue(wallet.audit())
+        wallet = arcula.Arcula(compact.CompactHierarchy.from_root(root).root, retention=dhka.Retention.SIGNING)
+        self.assertRaises(AssertionError, wallet.keygen, seed)
+
+    def test_extend(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        root = bip44.bip44_tree({'BTC': ((1, 2), )}, cls=hierarchy.ArculaNode)
+
+        wallet = arcula.Arcula(root)
+        wallet.keygen(seed)
+        certificate = root.certificate
+
+        coin_node = root.edges[0].edges[0]
+        account_node = hierarchy.ArculaNode(1)
+        account_node.edges.append(hierarchy.ArculaNode(0, 'XPUB'))
+        self.assertRaises(AssertionError, wallet.extend, coin_node, [account_node], crypto.sha3_512(b'other_seed'))
+
+        wallet.extend(coin_node, [account_node], seed)
+        self.assertIs(root.certificate, certificate)
+
+        for u, path in [
+            (account_node, (0, 2 ** 31 + 44, 0x80000000, 1)),
+            (account_node.edges[0], (0, 2 ** 31 + 44, 0x80000000, 1, 0))
+        ]:
+            signing_key, (_, message) = wallet.derive_signing_key(seed, path)
+            self.assertEqual(u._signing_key.to_der(), signing_key.to_der())
+            certificate, message = u.certificate
+            self.assertTrue(wallet.cold_storage_public_key.verify(certificate, b''.join(message),
+                                                                  hashfunc=hashlib.sha256,
+                                                                  sigdecode=ecdsa.util.sigdecode_der))
+
+    def test_parallel_keygen(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }
+        root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+        parallel_root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+
+        arcula.Arcula(root).keygen(seed)
+        wallet = arcula.Arcula(parallel_root)
+        wallet.keygen(seed, workers=2)
+        self.assertFalse(hasattr(wallet, '_cold_storage_key'))
+
+        for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(parallel_root)):
+            self.assertEqual((u._secret, u._key), (v._secret, v._key))
+            self.assertEqual(u._signing_key.to_der(), v._signing_key.to_der())
+            self.assertEqual(u.certificate[1], v.certificate[1])
+
+            certificate, message = v.certificate
+            self.assertTrue(wallet.cold_storage_public_key.verify(certificate, b''.join(message),
+                                                                  hashfunc=hashlib.sha256,
+                                                                  sigdecode=ecdsa.util.sigdecode_der))
+
+    def test_iter_keygen(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {'BTC': ((1, 2), (0, 1))}
+        root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode)
+        arcula.Arcula(root).keygen(seed)
+
+        wallet = arcula.Arcula(bip44.bip44_tree(config, cls=hierarchy.ArculaNode))
+        for u, certified in zip(hierarchy.breadth_first(root), wallet.iter_keygen(seed)):
+            self.assertEqual(certified.id, u.id)
+            self.assertEqual(certified.public_key,
+                             encode.verification_key_to_bytes_33(u._signing_key.get_verifying_key()))
+            self.assertEqual(certified.certificate[1], u.certificate[1])
+            self.assertEqual(len(certified.encrypted_edges), len(u.edges))
+
+            certificate, message = certified.certificate
+            self.assertTrue(wallet.cold_storage_public_key.verify(certificate, b''.join(message),
+                                                                  hashfunc=hashlib.sha256,
+                                                                  sigdecode=ecdsa.util.sigdecode_der))
+
 
 if __name__ == '__main__':
     unittest.main()
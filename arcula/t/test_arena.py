@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pickle
+import unittest
+
+from .. import arena
+
+__author__ = 'aldur'
+
+
+class KeyArenaTestCase(unittest.TestCase):
+    def test_slots(self):
+        for anonymous in (False, True):
+            a = arena.KeyArena(4, anonymous=anonymous)
+            self.assertEqual(len(a), 4)
+            self.assertEqual(bytes(a.region(0, 4)), bytes(4 * 32))
+
+            view = a.region(1, 3)
+            view[:] = b'\x01' * 32 + b'\x02' * 32
+            self.assertEqual(bytes(a.region(2, 3)), b'\x02' * 32)
+            self.assertEqual(len(a.region(3, 4)), 32)
+
+            copy = pickle.loads(pickle.dumps(a))
+            self.assertEqual((copy.anonymous, bytes(copy.region(1, 3))), (anonymous, bytes(view)))
+
+            a.wipe()
+            self.assertEqual(bytes(view), bytes(2 * 32))
+            self.assertEqual(bytes(a.region(0, 4)), bytes(4 * 32))
+
+            view.release()
+            a.close()
+            self.assertEqual(len(a), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@
 import itertools
 import unittest
 
-from .. import bip44
+from .. import bip44, hierarchy, constants, crypto, arcula, encode, dhka
 
 __author__ = 'aldur'
 
@@ -66,6 +66,207 @@ class BIP44TestCase(unittest.TestCase):
         self.assertRaises(IndexError, bip44.find_bip44_node_with_path, m, "m/44'/BTC/1/xpub/4")
         self.assertRaises(AssertionError, bip44.find_bip44_node_with_path, m, "m/44'/BTC/1/xpub/3/0")
 
+    def test_path_index(self):
+        config = {
+            'BTC': ((1, 2), (5, 4), (0, 1)),
+            'LTC': ((5, 5), ),
+        }
+        index = {}
+        m = bip44.bip44_tree(config, path_index=index)
+        self.assertEqual(len(index), sum(1 for _ in hierarchy.breadth_first(m)) - 2)
+
+        for coin, coin_config in config.items():
+            paths = [f"m/44'/{coin}"]
+            for i, (n_private_addresses, n_public_addresses) in enumerate(coin_config):
+                paths += [f"m/44'/{coin}/{i}", f"m/44'/{coin}/{i}/xpub", f"m/44'/{coin}/{i}/xpriv"]
+                paths += [f"m/44'/{coin}/{i}/xpub/{j}" for j in range(n_public_addresses)]
+                paths += [f"m/44'/{coin}/{i}/xpriv/{j}" for j in range(n_private_addresses)]
+            for path in paths:
+                self.assertIs(bip44.find_bip44_node_with_path(m, path, index), bip44.find_bip44_node_with_path(m, path))
+
+        hits = bip44.parse_path.cache_info().hits
+        self.assertEqual(bip44.parse_path("m/44'/BTC/1/xpub/3"), (constants.CoinType.BTC, 1, 0, 3))
+        self.assertEqual(bip44.parse_path.cache_info().hits, hits + 1)
+
+        self.assertRaises(IndexError, bip44.find_bip44_node_with_path, m, "m/44'/BTC/1/xpub/4", index)
+        self.assertRaises(AssertionError, bip44.find_bip44_node_with_path, m, "m/44'/BTC/1/xpub/3/0", index)
+
+    def test_flat_layout(self):
+        config = {
+            'BTC': ((1, 2), (5, 4), (0, 1)),
+            'LTC': ((5, 5), ),
+        }
+        index = {}
+        m = bip44.bip44_tree(config, path_index=index, layout=constants.WalletLayout.FLAT)
+        chained = bip44.bip44_tree(config)
+        self.assertEqual(sum(1 for _ in hierarchy.breadth_first(m)), sum(1 for _ in hierarchy.breadth_first(chained)))
+
+        branch = bip44.find_bip44_node_with_path(m, "m/44'/BTC/1/xpub")
+        self.assertEqual([v.id for v in branch.edges], list(range(4)))
+        self.assertTrue(all(not v.edges for v in branch.edges))
+
+        flat = constants.WalletLayout.FLAT
+        for path in ("m/44'/BTC/1/xpub/3", "m/44'/BTC/1/xpriv/0", "m/44'/LTC/0/xpriv/4", "m/44'/BTC/0/xpub/1"):
+            node = bip44.find_bip44_node_with_path(m, path, layout=flat)
+            self.assertIs(bip44.find_bip44_node_with_path(m, path, index, flat), node)
+            self.assertEqual(node.id, int(path.split('/')[-1]))
+            self.assertEqual(node.id, bip44.find_bip44_node_with_path(chained, path).id)
+            self.assertIn(node, bip44.find_bip44_node_with_path(m, path.rsplit('/', 1)[0]).edges)
+        # The layout is not inferred from the tree.
+        self.assertRaises(IndexError, bip44.find_bip44_node_with_path, m, "m/44'/BTC/1/xpub/1")
+
+        self.assertRaises(IndexError, bip44.find_bip44_node_with_path, m, "m/44'/BTC/1/xpub/4", layout=flat)
+
+    def test_flat_wallet(self):
+        seed = crypto.sha3_512(b'_secret_seed_flat_wallet')
+        config = {'BTC': ((2, 3), )}
+        wallet = bip44.ArculaBIP44(seed, config, layout=constants.WalletLayout.FLAT)
+        self.assertTrue(wallet.arcula.audit())
+
+        root = bip44.bip44_tree(config, cls=hierarchy.ArculaNode, layout=constants.WalletLayout.FLAT)
+        arcula.Arcula(root).keygen(seed, workers=2)
+        for u, v in zip(hierarchy.breadth_first(wallet.arcula.root), hierarchy.breadth_first(root)):
+            self.assertEqual((u._signing_scalar, u.certificate), (v._signing_scalar, v.certificate))
+
+        path = "m/44'/BTC/0/xpub/2"
+        signing_key, certificate = wallet.get_signing_key_certificate(path)
+        self.assertEqual(certificate[1][1], encode.int_to_bytes_8(2))
+        derived_key, _ = wallet.arcula.derive_signing_key(
+            seed, bip44.derivation_path(path, constants.WalletLayout.FLAT)
+        )
+        self.assertEqual(derived_key.to_der(), signing_key.to_der())
+
+        chained_wallet = bip44.ArculaBIP44(seed, config)
+        for path in ("m/44'/BTC", "m/44'/BTC/0/xpriv", "m/44'/BTC/0/xpub/2"):
+            derived_key, _ = chained_wallet.arcula.derive_signing_key(seed, bip44.derivation_path(path))
+            self.assertEqual(derived_key.to_der(), chained_wallet.get_signing_key_certificate(path)[0].to_der())
+        self.assertEqual(len(bip44.derivation_path(path)), 2 + 3 + 3)
+
+    def test_gap_limit(self):
+        seed = crypto.sha3_512(b'_secret_seed_gap_limit')
+        config = {'BTC': ((1, 2), (0, 1))}
+
+        for layout, lazy in itertools.product(constants.WalletLayout, (False, True)):
+            wallet = bip44.ArculaBIP44(seed, config, lazy=lazy, layout=layout, gap_limit=3)
+            key = (constants.CoinType.BTC.value, 0, 0)
+            self.assertEqual(set(wallet.address_counts.values()), {3})  # Each branch starts with the gap limit.
+            n_nodes = sum(1 for _ in hierarchy.breadth_first(wallet.arcula.root))
+            self.assertEqual(n_nodes, sum(1 for _ in hierarchy.breadth_first(
+                bip44.bip44_tree({'BTC': ((3, 3), (3, 3))}, layout=layout)
+            )))
+
+            seeds = {} if lazy else {'seed': seed}
+            self.assertEqual(wallet.next_address("m/44'/BTC/0/xpub", **seeds), "m/44'/BTC/0/xpub/0")
+            self.assertEqual(wallet.address_counts[key], 3 + 3)  # A whole batch is derived at once.
+            self.assertEqual(wallet.next_address("m/44'/BTC/0/xpub/", **seeds), "m/44'/BTC/0/xpub/1")
+            self.assertEqual(wallet.address_counts[key], 6)
+
+            wallet.mark_used("m/44'/BTC/0/xpub/7", **seeds)
+            self.assertEqual(wallet.last_used[key], 7)
+            self.assertEqual(wallet.address_counts[key], 11)
+            wallet.mark_used("m/44'/BTC/0/xpub/2", **seeds)
+            self.assertEqual((wallet.last_used[key], wallet.address_counts[key]), (7, 11))
+            self.assertRaises(AssertionError, wallet._resize_branch, key, 5, **seeds)
+            self.assertEqual(wallet.address_counts[key], 11)
+            self.assertIn(key + (10, ), wallet.path_index)
+            self.assertEqual(sum(1 for _ in hierarchy.breadth_first(wallet.arcula.root)), n_nodes + 8)
+
+            full = bip44.ArculaBIP44(seed, {'BTC': ((3, 11), (3, 3))}, layout=layout)
+            for path in [f"m/44'/BTC/0/xpub/{j}" for j in range(11)] + ["m/44'/BTC/1/xpriv/2"]:
+                signing_key, certificate = wallet.get_signing_key_certificate(path)
+                self.assertEqual(signing_key.to_der(), full.get_signing_key_certificate(path)[0].to_der())
+                self.assertEqual(certificate, full.get_signing_key_certificate(path)[1])
+                self.assertIs(bip44.find_bip44_node_with_path(wallet.arcula.root, path, layout=layout),
+                              bip44.find_bip44_node_with_path(wallet.arcula.root, path, wallet.path_index))
+            self.assertTrue(wallet.arcula.audit())
+
+        wallet = bip44.ArculaBIP44(seed, config, gap_limit=3)
+        self.assertRaises(AssertionError, wallet.next_address, "m/44'/BTC/0/xpub")
+        self.assertRaises(AssertionError, wallet.next_address, "m/44'/BTC/0")
+        self.assertRaises(AssertionError, bip44.ArculaBIP44, seed, config, gap_limit=3, retention=dhka.Retention.KEYS)
+
+    def test_update(self):
+        seed = crypto.sha3_512(b'_secret_seed_update')
+        config = {'BTC': ((2, 3), (1, 1)), 'LTC': ((1, 2), )}
+        updated = {'BTC': ((4, 1), ), 'TEST': ((1, 1), (2, 0))}
+
+        for layout, lazy in itertools.product(constants.WalletLayout, (False, True)):
+            wallet = bip44.ArculaBIP44(seed, config, lazy=lazy, layout=layout)
+            unchanged = [bip44.find_bip44_node_with_path(wallet.arcula.root, path, wallet.path_index)
+                         for path in ("m/44'/BTC", "m/44'/BTC/0/xpriv/1", "m/44'/BTC/0/xpub/0")]
+
+            wallet.update(updated, **({} if lazy else {'seed': seed}))
+            self.assertEqual(wallet.config, updated)
+            self.assertTrue(wallet.arcula.audit())
+
+            full = bip44.ArculaBIP44(seed, updated, layout=layout)
+            self.assertEqual(set(wallet.path_index), set(full.path_index))
+            self.assertEqual(wallet.address_counts, full.address_counts)
+            self.assertEqual(sum(1 for _ in hierarchy.breadth_first(wallet.arcula.root)),
+                             sum(1 for _ in hierarchy.breadth_first(full.arcula.root)))
+            for path in ("m/44'/BTC", "m/44'/BTC/0/xpriv/1", "m/44'/BTC/0/xpub/0"):
+                self.assertIn(bip44.find_bip44_node_with_path(wallet.arcula.root, path, wallet.path_index), unchanged)
+
+            for path in ("m/44'/BTC/0/xpriv/3", "m/44'/BTC/0/xpub/0", "m/44'/TEST/1/xpriv/1", "m/44'/TEST/0/xpub/0"):
+                signing_key, certificate = wallet.get_signing_key_certificate(path)
+                self.assertEqual(signing_key.to_der(), full.get_signing_key_certificate(path)[0].to_der())
+                self.assertEqual(certificate, full.get_signing_key_certificate(path)[1])
+            for path in ("m/44'/BTC/0/xpub/1", "m/44'/BTC/1"):
+                self.assertRaises(IndexError, bip44.find_bip44_node_with_path, wallet.arcula.root, path, None, layout)
+            self.assertRaises(AssertionError, bip44.find_bip44_node_with_path, wallet.arcula.root, "m/44'/LTC")
+
+        wallet = bip44.ArculaBIP44(seed, config, gap_limit=2)
+        wallet.mark_used("m/44'/BTC/0/xpub/3", seed)
+        wallet.update({'BTC': ((2, 1), (1, 1)), 'LTC': ((1, 2), )})
+        self.assertEqual(wallet.address_counts[(constants.CoinType.BTC.value, 0, 0)], 6)  # Used addresses are kept.
+        self.assertTrue(wallet.arcula.audit())
+
+        wallet = bip44.ArculaBIP44(seed, config)
+        key = (constants.CoinType.BTC.value, 0, 0)
+        wallet.mark_used("m/44'/BTC/0/xpub/5", seed)
+        wallet.update(config, seed)
+        self.assertEqual((wallet.address_counts[key], wallet.last_used[key]), (6, 5))
+        self.assertEqual(wallet.next_address("m/44'/BTC/0/xpub", seed), "m/44'/BTC/0/xpub/6")
+        wallet.update({'BTC': ((2, 8), (1, 1)), 'LTC': ((1, 2), )}, seed)
+        wallet.update(config, seed)
+        self.assertEqual((wallet.address_counts[key], wallet.last_used[key]), (7, 6))
+        self.assertTrue(wallet.arcula.audit())
+
+    def test_failed_update(self):
+        seed = crypto.sha3_512(b'_secret_seed_failed_update')
+        config = {'BTC': ((2, 3), (1, 1)), 'LTC': ((1, 2), )}
+        updated = {'BTC': ((2, 4), ), 'BCH': ((1, 1), )}
+
+        def state(wallet: bip44.ArculaBIP44) -> tuple:
+            return (wallet.config, dict(wallet.address_counts), dict(wallet.last_used), dict(wallet.path_index),
+                    [(u.id, len(u.edges), len(u.encrypted_edges)) for u in hierarchy.breadth_first(wallet.arcula.root)])
+
+        wallet = bip44.ArculaBIP44(seed, config)
+        wallet.mark_used("m/44'/BTC/0/xpub/1", seed)
+        before = state(wallet)
+        for bad_config, seeds in ((updated, {}), ({'BTC': ((0, 0), )}, {'seed': seed}), ({'XYZ': ((1, 1), )}, {}),
+                                  (updated, {'seed': crypto.sha3_512(b'_other_seed')})):
+            self.assertRaises(AssertionError, wallet.update, bad_config, **seeds)
+            self.assertEqual(state(wallet), before)
+
+        wallet.update(updated, seed)  # The wallet can still be updated.
+        self.assertTrue(wallet.arcula.audit())
+        self.assertEqual(wallet.address_counts, bip44.ArculaBIP44(seed, updated).address_counts)
+
+        wallet = bip44.ArculaBIP44(seed, config, lazy=True)
+        wallet.arcula.signer.close()
+        before = state(wallet)
+        self.assertRaises(AssertionError, wallet.update, updated)
+        self.assertEqual(state(wallet), before)
+
+        wallet = bip44.ArculaBIP44(seed, config, retention=dhka.Retention.KEYS)
+        before = state(wallet)
+        self.assertRaises(AssertionError, wallet.update, updated, seed)  # The secrets of the parents were released.
+        self.assertEqual(state(wallet), before)
+        wallet.update({'BTC': ((1, 3), )}, seed)  # Nodes can still be dropped.
+        self.assertEqual(wallet.address_counts, {(constants.CoinType.BTC.value, 0, 1): 1,
+                                                 (constants.CoinType.BTC.value, 0, 0): 3})
+
 
 if __name__ == '__main__':
     unittest.main()
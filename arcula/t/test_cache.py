@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from .. import cache
+
+__author__ = 'aldur'
+
+
+class CacheTestCase(unittest.TestCase):
+    def test_lru_cache(self):
+        c = cache.LRUCache(2)
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.get('a', 0), 0)
+
+        c['a'] = 1
+        c['b'] = 2
+        self.assertEqual(c.get('a'), 1)  # `b` is now the least recently used item.
+
+        c['c'] = 3
+        self.assertEqual(len(c), 2)
+        self.assertNotIn('b', c)
+        self.assertIn('a', c)
+        self.assertIn('c', c)
+
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertRaises(AssertionError, cache.LRUCache, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+from .. import certificates
+
+__author__ = 'aldur'
+
+
+class CertificatesTestCase(unittest.TestCase):
+    def test_certificate_key(self):
+        key = certificates.certificate_key(bytes(33), b'\x02' * 33, bytes(8))
+        self.assertEqual(len(key), 33 + 33 + 8)
+        self.assertRaises(AssertionError, certificates.certificate_key, bytes(33), bytes(32), bytes(8))
+
+    def test_cache(self):
+        key = certificates.certificate_key(bytes(33), b'\x02' * 33, bytes(8))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'certificates')
+            for c in (certificates.CertificateCache(), certificates.CertificateCache(path)):
+                with c:
+                    self.assertIsNone(c.get(key))
+                    c[key] = b'signature'
+                    self.assertIn(key, c)
+                    self.assertEqual(c.get(key), b'signature')
+                    self.assertEqual(len(c), 1)
+
+            with certificates.CertificateCache(path) as c:
+                self.assertEqual(c.get(key), b'signature')
+
+
+if __name__ == '__main__':
+    unittest.main()
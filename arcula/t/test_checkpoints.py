@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+from .. import checkpoints
+
+__author__ = 'aldur'
+
+
+class CheckpointsTestCase(unittest.TestCase):
+    def test_keys(self):
+        store = checkpoints.CheckpointStore(interval=2)
+        keys = store.keys(range(7))
+        self.assertEqual(len(keys), 3)
+        self.assertEqual(store.keys(range(4)), keys[:2])
+        self.assertNotEqual(store.keys([0, 1, 2, 4]), keys[:2])
+        self.assertEqual(store.keys(range(1)), [])
+        self.assertRaises(AssertionError, checkpoints.CheckpointStore, 0)
+
+    def test_store(self):
+        key = checkpoints.CheckpointStore().keys(range(64))[0]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoints')
+            for c in (checkpoints.CheckpointStore(), checkpoints.CheckpointStore(path=path)):
+                with c:
+                    c.bind(b'seed')
+                    c.bind(b'seed')
+                    self.assertRaises(AssertionError, c.bind, b'other_seed')
+
+                    self.assertIsNone(c.get(key))
+                    c[key] = b'secret'
+                    self.assertEqual(c.get(key), b'secret')
+                    self.assertEqual(len(c), 1)
+
+            with checkpoints.CheckpointStore(path=path) as c:
+                self.assertEqual(c.get(key), b'secret')
+                self.assertRaises(AssertionError, c.bind, b'other_seed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from .. import hierarchy, crypto, dhka, arcula, bip44, compact, encode
+
+__author__ = 'aldur'
+
+
+class CompactTestCase(unittest.TestCase):
+    config = {'BTC': ((2, 3), (0, 1)), 'LTC': ((1, 1), )}
+
+    def test_structure(self):
+        root = bip44.bip44_tree(self.config)
+        tree = compact.CompactHierarchy.from_root(root)
+        nodes = list(hierarchy.breadth_first(root))
+        self.assertEqual(len(tree), len(nodes))
+        self.assertEqual(compact.CompactHierarchy.from_shape(hierarchy.shape(root)).ids, tree.ids)
+
+        views = list(hierarchy.breadth_first(tree.root))
+        self.assertEqual(len(views), len(nodes))
+        for i, (u, v) in enumerate(zip(nodes, views)):
+            self.assertEqual(v, tree.node(i))
+            self.assertEqual((v.id, v.tag, str(v)), (u.id, u.tag, str(u)))
+            self.assertEqual([w.id for w in v.edges], [w.id for w in u.edges])
+            for w in v.edges:
+                self.assertEqual(tree.parent(w.index), i)
+        self.assertIsNone(tree.parent(0))
+        self.assertRaises(AssertionError, compact.CompactHierarchy, [0, 1], [2, 0])
+
+    def test_dhka_keygen(self):
+        seed = crypto.sha3_512_half(b'test_compact_dhka_keygen')
+        root = bip44.bip44_tree(self.config, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        tree = compact.CompactHierarchy.from_root(root)
+        scheme = dhka.DHKA(tree.root)
+        scheme.keygen(seed)
+
+        for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(tree.root)):
+            self.assertEqual((v._label, v._secret, v._encryption_key, v._key),
+                             (u._label, u._secret, u._encryption_key, u._key))
+            self.assertEqual(len(v.encrypted_edges), len(u.encrypted_edges))
+            for w, edge in zip(v.edges, v.encrypted_edges):
+                edge_encryption_key = scheme._edge_encryption_key(v._encryption_key, w._label)
+                self.assertEqual(scheme._decrypt_edge(edge_encryption_key, edge), w._encryption_key + w._key)
+
+        leaf = tree.root
+        path = []
+        while leaf.edges:
+            leaf = leaf.edges[-1]
+            path.append(leaf.id)
+        self.assertEqual(scheme.derive_from_edges(tree.root, tree.root._encryption_key, path),
+                         (leaf._encryption_key, leaf._key))
+
+        keys, encryption_keys = bytes(tree.keys), bytes(tree.encryption_keys)
+        tree.keys[32:], tree.encryption_keys[32:] = bytes(len(keys) - 32), bytes(len(keys) - 32)
+        scheme.unlock(tree.root, tree.root._encryption_key)
+        self.assertEqual((tree.keys, tree.encryption_keys), (keys, encryption_keys))
+
+        self.assertRaises(AssertionError, scheme.extend, tree.root, [hierarchy.DHKANode(7)])
+        self.assertRaises(AssertionError, dhka.DHKA(tree.root).keygen, seed, 2)
+
+    def test_edge_encryption(self):
+        seed = crypto.sha3_512_half(b'test_compact_edge_encryption')
+        tree = compact.CompactHierarchy.from_root(bip44.bip44_tree(self.config))
+        scheme = dhka.DHKA(tree.root, edge_encryption=dhka.EdgeEncryption.SKIP)
+        scheme.keygen(seed)
+        self.assertEqual((tree.edge_widths, tree.root.encrypted_edges), (None, []))
+
+        tree = compact.CompactHierarchy.from_root(bip44.bip44_tree(self.config))
+        scheme = dhka.DHKA(tree.root, edge_encryption=dhka.EdgeEncryption.LAZY)
+        scheme.keygen(seed)
+        self.assertIsNone(tree.edge_widths)
+
+        for v in hierarchy.breadth_first(tree.root):
+            self.assertEqual(len(v.encrypted_edges), len(v.edges))
+            for w, edge in zip(v.edges, v.encrypted_edges):
+                edge_encryption_key = scheme._edge_encryption_key(v._encryption_key, w._label)
+                self.assertEqual(scheme._decrypt_edge(edge_encryption_key, edge), w._encryption_key + w._key)
+        self.assertEqual(tree.root.encrypted_edges, tree.root.encrypted_edges)
+
+    def test_arcula_keygen(self):
+        seed = crypto.sha3_512(b'test_compact_arcula_keygen')
+        root = bip44.bip44_tree(self.config, cls=hierarchy.ArculaNode)
+        arcula.Arcula(root).keygen(seed)
+
+        for workers, lazy in ((1, False), (2, False), (1, True)):
+            tree = compact.CompactHierarchy.from_root(root)
+            wallet = arcula.Arcula(tree.root)
+            wallet.keygen(seed, workers=workers, lazy=lazy)
+
+            for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(tree.root)):
+                self.assertEqual(v._signing_scalar, u._signing_scalar)
+                self.assertEqual(v._signing_key.to_der(), u._signing_key.to_der())
+                self.assertEqual(v.certificate, u.certificate)
+                self.assertEqual(v.certificate[1][0],
+                                 encode.verification_key_to_bytes_33(v._signing_key.get_verifying_key()))
+            self.assertTrue(wallet.audit())
+
+    def test_key_material(self):
+        seed = crypto.sha3_512(b'test_compact_key_material')
+        tree = compact.CompactHierarchy.from_root(bip44.bip44_tree(self.config), anonymous=True)
+        wallet = arcula.Arcula(tree.root)
+        wallet.keygen(seed)
+
+        u = tree.node(len(tree) - 1)
+        secret, encryption_key, key = tree.key_views(u.index)
+        self.assertEqual((secret, encryption_key, key), (u._secret, u._encryption_key, u._key))
+        self.assertIsNotNone(u._signing_key)
+
+        tree.wipe()
+        self.assertEqual(bytes(key), bytes(32))
+        self.assertIsNone(u._key)
+        self.assertIsNone(u._signing_key)
+        self.assertEqual(len(tree.signing_keys._keys), 0)
+
+        self.assertRaises(BufferError, tree.close)
+        for view in (secret, encryption_key, key):
+            view.release()
+        tree.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -36,6 +36,16 @@ class CryptoTestCase(unittest.TestCase):
         self.assertEqual(crypto.sha3_512_half_k(k, v), truth)
         self.assertEqual(len(crypto.sha3_512_half_k(k, v)), 512 // 8 // 2)
 
+    def test_sha3_512_half_k_batch(self):
+        k = b'test_sha3_512_half_k_batch_k'
+        vs = [b'', b'v', b'test_sha3_512_half_k_batch_v' * 10]
+        truth = [crypto.sha3_512_half_k(k, v) for v in vs]
+
+        self.assertEqual(crypto.sha3_512_half_k_batch(k, vs), truth)
+        self.assertEqual(crypto.prf_batch(crypto.sha3_512_half_k, k, vs), truth)
+        self.assertEqual(crypto.prf_batch(lambda k_, v_: crypto.sha3_512_half_k(k_, v_), k, vs), truth)
+        self.assertEqual(crypto.sha3_512_half_k_batch(k, []), [])
+
     def test_aes_gcm(self):
         self.assertRaises(AssertionError, crypto.aes_ae, bytes(10), b'')
 
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import itertools
+import os
+import tempfile
 import unittest
 
 __author__ = 'aldur'
 
-from .. import hierarchy, crypto, dhka, constants, encode, bip44
+from .. import hierarchy, crypto, dhka, constants, encode, bip44, checkpoints
 
 
 class DHKATestCase(unittest.TestCase):
@@ -89,6 +92,308 @@ class DHKATestCase(unittest.TestCase):
                 self.assert_node_from_parent_secret(tree, v, u._secret)
                 self.assert_edge_public(tree, u, v, u.encrypted_edges[i])
 
+    def test_derive(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        root = bip44.bip44_tree({
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }, cls=hierarchy.DHKANode)
+
+        tree = dhka.DHKA(root)
+        tree.keygen(seed)
+
+        other_tree = dhka.DHKA(bip44.bip44_tree({'BTC': ((1, 1), )}, cls=hierarchy.DHKANode), cache_size=4)
+        q = [(root, (root.id, ))]
+        while q:
+            u, path = q.pop()
+            self.assertEqual(other_tree.derive(seed, path), (u._label, u._secret, u._encryption_key, u._key))
+            self.assertEqual(other_tree.derive(seed, path), (u._label, u._secret, u._encryption_key, u._key))
+            self.assertLessEqual(len(other_tree._derivation_cache), 4)
+            q.extend((v, path + (v.id, )) for v in u.edges)
+
+        self.assertNotEqual(other_tree.derive(crypto.sha3_512(b'other_seed'), (root.id, ))[1], root._secret)
+        self.assertEqual(len(other_tree._derivation_cache), 1)
+        self.assertRaises(AssertionError, other_tree.derive, seed, ())
+
+    def test_derive_checkpoints(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {'BTC': ((1, 40), )}
+        root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        prf_calls = []
+
+        def prf_f(k: bytes, m: bytes) -> bytes:
+            prf_calls.append(m)
+            return crypto.sha3_512_half_k(k, m)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoints')
+            with checkpoints.CheckpointStore(interval=4, path=path) as store:
+                tree = dhka.DHKA(root, prf_f=prf_f, cache_size=1, checkpoints=store)
+                paths = sorted(self._paths(root), key=lambda item: -len(item[1]))  # Skip the derivation cache.
+                for u, p in paths:
+                    self.assertEqual(tree.derive(seed, p), (u._label, u._secret, u._encryption_key, u._key))
+                self.assertEqual(len(store), (len(paths[0][1]) - 1) // 4)
+                self.assertRaises(AssertionError, tree.derive, crypto.sha3_512(b'other_seed'), paths[0][1])
+
+            with checkpoints.CheckpointStore(interval=4, path=path) as store:
+                tree = dhka.DHKA(root, prf_f=prf_f, checkpoints=store)
+                u, p = paths[0]
+                prf_calls.clear()
+                self.assertEqual(tree.derive(seed, p), (u._label, u._secret, u._encryption_key, u._key))
+                self.assertLessEqual(len(prf_calls), 4 + 3)
+
+    @staticmethod
+    def _paths(root):
+        q = [(root, (root.id, ))]
+        while q:
+            u, path = q.pop()
+            yield u, path
+            q.extend((v, path + (v.id, )) for v in u.edges)
+
+    def test_extend(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        root = bip44.bip44_tree({'BTC': ((1, 2), )}, cls=hierarchy.DHKANode)
+        extended_config = {'BTC': ((1, 2), (2, 0))}
+        extended_root = bip44.bip44_tree(extended_config, cls=hierarchy.DHKANode)
+
+        tree = dhka.DHKA(root)
+        tree.keygen(seed)
+        dhka.DHKA(extended_root).keygen(seed)
+
+        coin_node = root.edges[0].edges[0]
+        encrypted_edges = list(coin_node.encrypted_edges)
+        account_node = bip44.bip44_tree(extended_config, cls=hierarchy.DHKANode).edges[0].edges[0].edges[1]
+        tree.extend(coin_node, [account_node])
+        self.assertEqual(coin_node.encrypted_edges[:1], encrypted_edges)  # Existing edges are left untouched.
+        self.assertRaises(AssertionError, tree.extend, coin_node, [hierarchy.DHKANode(1)])
+
+        q = [(root, extended_root)]
+        while q:
+            u, w = q.pop()
+            self.assertEqual((u.id, u._secret, u._key), (w.id, w._secret, w._key))
+            self.assertEqual(len(u.edges), len(u.encrypted_edges))
+            for i, v in enumerate(u.edges):
+                self.assert_edge_public(tree, u, v, u.encrypted_edges[i])
+            q.extend(zip(u.edges, w.edges))
+
+    def test_parallel_keygen(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }
+        root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        parallel_root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+
+        tree = dhka.DHKA(root)
+        tree.keygen(seed)
+        dhka.DHKA(parallel_root).keygen(seed, workers=2)
+
+        for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(parallel_root)):
+            self.assertEqual((u._label, u._secret, u._encryption_key, u._key),
+                             (v._label, v._secret, v._encryption_key, v._key))
+            self.assertEqual(len(v.edges), len(v.encrypted_edges))
+            for i, w in enumerate(v.edges):
+                self.assert_edge_public(tree, v, w, v.encrypted_edges[i])
+
+    def test_retention(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }
+        root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        for retention, workers in itertools.product((dhka.Retention.KEYS, dhka.Retention.SIGNING), (1, 2)):
+            retained_root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+            tree = dhka.DHKA(retained_root, retention=retention)
+            tree.keygen(seed, workers=workers)
+
+            for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(retained_root)):
+                self.assertEqual((v._label, v._secret, v.encrypted_edges and len(v.encrypted_edges)),
+                                 (None, None, u.encrypted_edges and len(u.encrypted_edges)))
+                self.assertEqual(v._key, u._key)
+                if retention is dhka.Retention.KEYS:
+                    self.assertEqual(v._encryption_key, u._encryption_key)
+                    for w, edge_cipher in zip(v.edges, v.encrypted_edges):
+                        self.assertEqual(tree.derive_from_edges(v, v._encryption_key, (w.id, )),
+                                         (w._encryption_key, w._key))
+                else:
+                    self.assertIsNone(v._encryption_key)
+
+            self.assertRaises(AssertionError, tree.extend, retained_root, [hierarchy.DHKANode(3)])
+
+    def test_edge_encryption(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }
+        root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        for edge_encryption, retention, workers in (
+                (dhka.EdgeEncryption.SKIP, dhka.Retention.FULL, 1), (dhka.EdgeEncryption.SKIP, dhka.Retention.FULL, 2),
+                (dhka.EdgeEncryption.LAZY, dhka.Retention.FULL, 1), (dhka.EdgeEncryption.LAZY, dhka.Retention.FULL, 2),
+                (dhka.EdgeEncryption.LAZY, dhka.Retention.KEYS, 1),
+        ):
+            deferred_root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+            tree = dhka.DHKA(deferred_root, retention=retention, edge_encryption=edge_encryption)
+            tree.keygen(seed, workers=workers)
+
+            for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(deferred_root)):
+                self.assertEqual((v._encryption_key, v._key), (u._encryption_key, u._key))
+                deferred = edge_encryption is dhka.EdgeEncryption.LAZY and bool(v.edges)
+                self.assertEqual(v._edge_encrypter is not None, deferred)
+                if edge_encryption is dhka.EdgeEncryption.SKIP:
+                    self.assertEqual(v.encrypted_edges, [])
+                    continue
+
+                self.assertEqual(len(v.encrypted_edges), len(v.edges))
+                self.assertIsNone(v._edge_encrypter)
+                for w, edge_cipher in zip(v.edges, v.encrypted_edges):
+                    self.assertEqual(tree.derive_from_edges(v, v._encryption_key, (w.id, )),
+                                     (w._encryption_key, w._key))
+
+        lazy_root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        tree = dhka.DHKA(lazy_root, edge_encryption=dhka.EdgeEncryption.LAZY)
+        tree.keygen(seed)
+        coin_node = lazy_root.edges[0].edges[0]
+        self.assertEqual(len(coin_node.encrypted_edges), 2)
+        tree.extend(coin_node, [hierarchy.DHKANode(2)])
+        self.assertEqual(len(coin_node.encrypted_edges), 3)
+        self.assertEqual(tree.derive_from_edges(coin_node, coin_node._encryption_key, (2, )),
+                         (coin_node.edges[2]._encryption_key, coin_node.edges[2]._key))
+
+        self.assertRaises(AssertionError, dhka.DHKA, root, retention=dhka.Retention.SIGNING,
+                          edge_encryption=dhka.EdgeEncryption.LAZY)
+
+        streamed = list(dhka.DHKA(root, edge_encryption=dhka.EdgeEncryption.SKIP).iter_keygen(seed))
+        self.assertTrue(all(d.encrypted_edges == [] for d in streamed))
+
+    def test_iter_keygen(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }
+        root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        streamed_root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        tree = dhka.DHKA(streamed_root)
+        nodes = list(hierarchy.breadth_first(root))
+        derived_nodes = list(tree.iter_keygen(seed))
+        self.assertEqual(len(derived_nodes), len(nodes))
+        self.assertIsNone(streamed_root._secret)
+
+        for i, (u, derived) in enumerate(zip(nodes, derived_nodes)):
+            self.assertEqual(derived.index, i)
+            self.assertEqual((derived.id, derived.label, derived.secret, derived.encryption_key, derived.key),
+                             (u.id, u._label, u._secret, u._encryption_key, u._key))
+            for v, edge_cipher in zip(u.edges, derived.encrypted_edges):
+                self.assert_edge_public(tree, u, v, edge_cipher)
+            for v in u.edges:
+                self.assertEqual(derived_nodes[nodes.index(v)].parent, i)
+
+    def test_derive_from_edges(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        root = bip44.bip44_tree({
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ),
+        }, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        coin_node = root.edges[0].edges[1]
+        tree = dhka.DHKA(root, cache_size=3)
+        q = [(v, (v.id, )) for v in coin_node.edges]
+        while q:
+            u, path = q.pop()
+            self.assertEqual(tree.derive_from_edges(coin_node, coin_node._encryption_key, path),
+                             (u._encryption_key, u._key))
+            self.assertLessEqual(len(tree._edge_cache), 3)
+            q.extend((v, path + (v.id, )) for v in u.edges)
+
+        path = (0, 1, 0)
+        tree.derive_from_edges(coin_node, coin_node._encryption_key, path)
+        coin_node.encrypted_edges[0] = None  # Cached edges are not decrypted again.
+        self.assertEqual(tree.derive_from_edges(coin_node, coin_node._encryption_key, path[:2]),
+                         (coin_node.edges[0].edges[1]._encryption_key, coin_node.edges[0].edges[1]._key))
+
+        self.assertRaises(AssertionError, tree.derive_from_edges, coin_node, coin_node._encryption_key, ())
+        self.assertRaises(AssertionError, tree.derive_from_edges, coin_node, coin_node._encryption_key, (5, ))
+        self.assertRaises(Exception, tree.derive_from_edges, root, coin_node._encryption_key, (root.edges[0].id, ))
+
+    def test_detach(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        root = bip44.bip44_tree({'BTC': ((1, 1), (1, 1), (1, 1))}, cls=hierarchy.DHKANode)
+        tree = dhka.DHKA(root)
+        tree.keygen(seed)
+
+        coin_node = root.edges[0].edges[0]
+        account, target = coin_node.edges[2], coin_node.edges[2].edges[0]
+        self.assertEqual(tree.derive_from_edges(coin_node, coin_node._encryption_key, (2, 0)),
+                         (target._encryption_key, target._key))
+
+        tree.detach(coin_node, coin_node.edges[0])
+        self.assertEqual([v.id for v in coin_node.edges], [1, 2])
+        self.assertEqual(len(coin_node.encrypted_edges), 2)
+        self.assertEqual(tree.derive_from_edges(coin_node, coin_node._encryption_key, (2, 0)),
+                         (target._encryption_key, target._key))
+        self.assertEqual(tree.derive_from_edges(coin_node, coin_node._encryption_key, (2, )),
+                         (account._encryption_key, account._key))
+        self.assertRaises(AssertionError, tree.derive_from_edges, coin_node, coin_node._encryption_key, (0, ))
+
+        tree.truncate(coin_node, 1)
+        self.assertEqual(([v.id for v in coin_node.edges], len(coin_node.encrypted_edges)), ([1], 1))
+        self.assertRaises(AssertionError, tree.derive_from_edges, coin_node, coin_node._encryption_key, (2, 0))
+        self.assertRaises(AssertionError, tree.truncate, coin_node, 2)
+
+    def test_unlock(self):
+        seed = crypto.sha3_512(b'_secret_seed')
+        config = {
+            'BTC': ((1, 2), (0, 1)),
+            'LTC': ((2, 3), ) * 40,
+        }
+        root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        dhka.DHKA(root).keygen(seed)
+
+        locked_root = bip44.bip44_tree(config, cls=hierarchy.DHKANode)
+        for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(locked_root)):
+            v.encrypted_edges = u.encrypted_edges
+
+        coin_node, locked_coin_node = root.edges[0].edges[1], locked_root.edges[0].edges[1]
+        tree = dhka.DHKA(locked_root)
+        tree.unlock(locked_coin_node, coin_node._encryption_key, workers=2)
+
+        for u, v in zip(hierarchy.breadth_first(coin_node), hierarchy.breadth_first(locked_coin_node)):
+            self.assertEqual((u._encryption_key, u._key if u is not coin_node else None), (v._encryption_key, v._key))
+            self.assertIsNone(v._secret)
+        self.assertIsNone(locked_root.edges[0].edges[0].edges[0]._key)
+
+    def test_prf_batch(self):
+        seed = crypto.sha3_512(b'secret_seed')
+        calls = []
+
+        def prf_batch_f(k, ms):
+            calls.append(len(ms))
+            return crypto.sha3_512_half_k_batch(k, ms)
+
+        root = bip44.bip44_tree({'BTC': ((0, 5), )}, cls=hierarchy.DHKANode)
+        root.edges[0].edges[0].edges[0].edges[0].edges += [hierarchy.DHKANode(i) for i in range(1, 10)]
+        tree = dhka.DHKA(root, prf_batch_f=prf_batch_f)
+        tree.keygen(seed)
+        self.assertIn(10, calls)  # A single batch for the secrets (and for the edges) of the 10 siblings.
+
+        other_root = bip44.bip44_tree({'BTC': ((0, 5), )}, cls=hierarchy.DHKANode)
+        other_root.edges[0].edges[0].edges[0].edges[0].edges += [hierarchy.DHKANode(i) for i in range(1, 10)]
+        dhka.DHKA(other_root).keygen(seed)
+        for u, v in zip(hierarchy.breadth_first(root), hierarchy.breadth_first(other_root)):
+            self.assertEqual((u._secret, u._encryption_key, u._key), (v._secret, v._encryption_key, v._key))
+
 
 if __name__ == '__main__':
     unittest.main()
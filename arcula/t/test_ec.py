@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import pickle
+import unittest
+
+import ecdsa
+
+from cryptography.exceptions import UnsupportedAlgorithm
+
+from .. import crypto, ec
+
+__author__ = 'aldur'
+
+
+class ECTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backends = [
+            ec.EcdsaBackend(ecdsa.SECP256k1), ec.OpenSSLBackend(ecdsa.SECP256k1), ec.FixedBaseBackend(ecdsa.SECP256k1)
+        ]
+        self.exponent = ecdsa.util.randrange_from_seed__trytryagain(b'test_ec', ecdsa.SECP256k1.order)
+
+    def test_public_point(self):
+        k = ecdsa.SigningKey.from_secret_exponent(self.exponent, ecdsa.SECP256k1)
+        point = k.get_verifying_key().pubkey.point
+        for backend in self.backends:
+            self.assertEqual(backend.public_point(self.exponent), (point.x(), point.y()))
+
+    def test_public_points(self):
+        exponents = [self.exponent + i for i in range(10)]
+        truth = [self.backends[0].public_point(exponent) for exponent in exponents]
+        for backend in self.backends:
+            self.assertEqual(backend.public_points(exponents), truth)
+            self.assertEqual(backend.public_points([]), [])
+
+    def test_sign_verify(self):
+        m = b'test_sign_verify_m'
+        k = ecdsa.SigningKey.from_secret_exponent(self.exponent, ecdsa.SECP256k1)
+        public_point = self.backends[0].public_point(self.exponent)
+
+        for signer in self.backends:
+            signature = signer.sign(self.exponent, m)
+            self.assertEqual(
+                ecdsa.util.sigencode_der_canonize(
+                    *ecdsa.util.sigdecode_der(signature, ecdsa.SECP256k1.order), ecdsa.SECP256k1.order
+                ), signature
+            )
+            self.assertTrue(k.get_verifying_key().verify(
+                signature, m, hashfunc=hashlib.sha256, sigdecode=ecdsa.util.sigdecode_der
+            ))
+
+            for verifier in self.backends:
+                verifier.precompute(public_point)
+                self.assertTrue(verifier.verify(public_point, signature, m))
+                self.assertFalse(verifier.verify(public_point, signature, m + b'x'))
+                self.assertFalse(verifier.verify(public_point, signature[:-1], m))
+
+    def test_sign_batch(self):
+        ms = [b'', b'm', b'test_sign_batch' * 10]
+        k = ecdsa.SigningKey.from_secret_exponent(self.exponent, ecdsa.SECP256k1)
+        for backend in self.backends:
+            state = dict(vars(backend))
+            self.assertEqual(backend.sign_batch(self.exponent, ms), [backend.sign(self.exponent, m) for m in ms])
+            self.assertEqual(crypto.ecdsa_sign_batch(k, ms, backend), crypto.ecdsa_sign_batch(k, ms))
+            self.assertEqual(backend.sign_batch(self.exponent, []), [])
+            self.assertEqual(vars(backend), state)  # The private key is not retained.
+
+    def test_deterministic(self):
+        for m in (b'', b'm'):
+            signatures = {backend.sign(self.exponent, m) for backend in self.backends}
+            self.assertEqual(len(signatures), 1)
+
+    def test_fixed_base_deterministic(self):
+        backend = ec.FixedBaseBackend(ecdsa.SECP256k1)
+        k = ecdsa.SigningKey.from_secret_exponent(self.exponent, ecdsa.SECP256k1)
+        for m in (b'', b'm', b'test_fixed_base_deterministic' * 10):
+            self.assertEqual(backend.sign(self.exponent, m), k.sign_deterministic(
+                m, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der_canonize
+            ))
+
+    def test_crypto(self):
+        seed = crypto.sha3_512_half(b'test_crypto')
+        truth = crypto.ecdsa_keygen(seed, ecdsa.SECP256k1)
+        for backend in self.backends:
+            k = crypto.ecdsa_keygen(seed, ecdsa.SECP256k1, backend)
+            self.assertEqual(k.to_der(), truth.to_der())
+            self.assertTrue(backend.verify(backend.public_point(k.privkey.secret_multiplier),
+                                           crypto.ecdsa_sign(k, b'm', backend), b'm'))
+
+    def test_signing_keys(self):
+        keys = ec.SigningKeys(ecdsa.SECP256k1, self.backends[-1], maxsize=2)
+        scalars = [(self.exponent + i).to_bytes(32, 'big') for i in range(3)]
+        for i, scalar in enumerate(scalars):
+            k = keys.get(scalar)
+            truth = ecdsa.SigningKey.from_secret_exponent(self.exponent + i, ecdsa.SECP256k1)
+            self.assertEqual(k.to_der(), truth.to_der())
+            self.assertIs(keys.get(scalar), k)
+
+        self.assertEqual(len(keys._keys), 2)
+        self.assertEqual(len(pickle.loads(pickle.dumps(keys))._keys), 0)
+
+    def test_default_backend(self):
+        self.assertIsInstance(ec.default_backend(ecdsa.SECP256k1), ec.FixedBaseBackend)
+        self.assertRaises(UnsupportedAlgorithm, ec.OpenSSLBackend, ecdsa.NIST521p)
+
+        backend = ec.default_backend(ecdsa.SECP256k1)
+        backend.sign(self.exponent, b'm')
+        self.assertTrue(backend.verify(backend.public_point(self.exponent), pickle.loads(pickle.dumps(backend)).sign(
+            self.exponent, b'm'
+        ), b'm'))
+
+
+if __name__ == '__main__':
+    unittest.main()
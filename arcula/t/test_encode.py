@@ -74,6 +74,7 @@ class EncodeTestCase(unittest.TestCase):
             self.assertEqual(e[0], 0x03)
 
         self.assertEqual(encode.bytes_32_to_int(e[1:]), point.x())
+        self.assertEqual(encode.point_to_bytes_33((point.x(), point.y())), e)
 
 
 if __name__ == '__main__':
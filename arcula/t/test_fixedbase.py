@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import ecdsa
+
+from .. import fixedbase, ec
+
+__author__ = 'aldur'
+
+
+class FixedBaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.curve = ecdsa.SECP256k1
+        self.point = (self.curve.generator * 7).to_affine()
+        self.point = self.point.x(), self.point.y()
+        self.table = fixedbase.Table.build(self.curve, self.point)
+
+    def test_multiply(self):
+        n = self.curve.order
+        for k in (1, 2, 255, 256, 257, 2 ** 255, n - 1, n + 3,
+                  ecdsa.util.randrange_from_seed__trytryagain(b'test_multiply', n)):
+            truth = (self.curve.generator * (7 * k % n)).to_affine()
+            self.assertEqual(self.table.multiply(k), (truth.x(), truth.y()))
+
+        self.assertIsNone(self.table.multiply(0))
+        self.assertIsNone(self.table.multiply(n))
+
+    def test_add(self):
+        p = self.curve.curve.p()
+        q = self.table.multiply_jacobian(5)
+        self.assertEqual(fixedbase.to_affine(p, fixedbase.add(self.curve.curve, q, q)), self.table.multiply(10))
+        self.assertIsNone(fixedbase.add(self.curve.curve, q, self.table.multiply_jacobian(self.curve.order - 5)))
+        self.assertEqual(fixedbase.add(self.curve.curve, q, None), q)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'table')
+            self.table.save(path)
+
+            table = fixedbase.Table.load(path, self.curve, self.point)
+            self.assertEqual(table.multiply(12345), self.table.multiply(12345))
+            self.assertEqual(pickle.loads(pickle.dumps(table)).multiply(12345), self.table.multiply(12345))
+            self.assertRaises(AssertionError, fixedbase.Table.load, path, self.curve, (self.point[0], 0))
+
+            backend = ec.FixedBaseBackend(self.curve, directory)
+            backend.precompute(self.point)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertEqual(
+                ec.FixedBaseBackend(self.curve, directory).precompute(self.point).multiply(3), self.table.multiply(3)
+            )
+
+            path = os.path.join(directory, next(name for name in os.listdir(directory) if name != 'table'))
+            with open(path, 'r+b') as f:  # Flip a bit of the entry used to multiply by 1.
+                f.seek(os.path.getsize(path) - self.table._windows * 255 * 64)
+                byte = f.read(1)
+                f.seek(-1, os.SEEK_CUR)
+                f.write(bytes([byte[0] ^ 1]))
+            self.assertRaises(ValueError, fixedbase.Table.load, path, self.curve, self.point)
+            self.assertEqual(ec.FixedBaseBackend(self.curve, directory).precompute(self.point).multiply(1), self.point)
+            self.assertTrue(fixedbase.Table.load(path, self.curve, self.point).verify())  # The table was rebuilt.
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from .. import hierarchy, bip44
+
+__author__ = 'aldur'
+
+
+class HierarchyTestCase(unittest.TestCase):
+    def test_breadth_first(self):
+        root = hierarchy.Node(0, tag='root')
+        left, right = hierarchy.Node(0, tag='l'), hierarchy.Node(1, tag='r')
+        root.edges += [left, right]
+        left.edges.append(hierarchy.Node(0, tag='ll'))
+        self.assertEqual([u.tag for u in hierarchy.breadth_first(root)], ['root', 'l', 'r', 'll'])
+
+        right.edges.append(left.edges[0])
+        self.assertRaises(AssertionError, list, hierarchy.breadth_first(root))
+
+    def test_shape(self):
+        root = bip44.bip44_tree({'BTC': ((1, 2), (0, 1))})
+        nodes = hierarchy.from_shape(hierarchy.shape(root), cls=hierarchy.DHKANode)
+
+        self.assertIsInstance(nodes[0], hierarchy.DHKANode)
+        self.assertEqual(list(hierarchy.breadth_first(nodes[0])), nodes)
+        self.assertEqual(hierarchy.shape(nodes[0]), hierarchy.shape(root))
+
+
+if __name__ == '__main__':
+    unittest.main()